@@ -17,7 +17,35 @@ app.conf.beat_schedule= {
     'send-mail-everyday-at-11-20-pm': {
         'task': 'send_mail_app.tasks.send_mail_function',
         'schedule': crontab(hour=23, minute=53)
-    }
+    },
+    'flush-recipe-like-buffer': {
+        'task': 'recipe.tasks.flush_like_buffer',
+        'schedule': settings.RECIPE_LIKE_FLUSH_INTERVAL,
+    },
+    'update-trending-recipe-scores': {
+        'task': 'recipe.tasks.update_trending_scores',
+        'schedule': settings.RECIPE_TRENDING_INTERVAL,
+    },
+    'rebuild-trending-recipe-scores-nightly': {
+        'task': 'recipe.tasks.rebuild_trending_scores',
+        'schedule': crontab(hour=4, minute=0)
+    },
+    'build-similar-recipes-nightly': {
+        'task': 'recipe.tasks.build_similar_recipes',
+        'schedule': crontab(hour=3, minute=30)
+    },
+    'collect-media-blobs': {
+        'task': 'recipe.tasks.collect_media_blobs',
+        'schedule': settings.MEDIA_BLOB_GC_INTERVAL,
+    },
+    'flush-expired-refresh-tokens-hourly': {
+        'task': 'users.tasks.flush_expired_tokens',
+        'schedule': crontab(minute=30)
+    },
+    'expire-upload-sessions-hourly': {
+        'task': 'recipe.tasks.expire_upload_sessions',
+        'schedule': crontab(minute=0)
+    },
 }
 
 app.autodiscover_tasks()
@@ -100,6 +100,14 @@ else:
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
+PASSWORD_HASHERS = [
+    'users.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -158,13 +166,16 @@ EMAIL_HOST_PASSWORD = config('EMAIL_PASSWORD')
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Reverse proxies in front of the app. Throttles take the client IP from
+    # X-Forwarded-For only behind that many, from REMOTE_ADDR otherwise
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
 }
 
 SPECTACULAR_SETTINGS = {
@@ -204,6 +215,78 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Cache
+if(config('DJANGO_ENV') == 'local'):
+    CACHE_REDIS_URL = 'redis://redis:6379/1' #development
+else:
+    CACHE_REDIS_URL = config("REDIS_URL") #prod
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+        'TIMEOUT': 300,
+        'KEY_PREFIX': 'recipe-api',
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SOCKET_CONNECT_TIMEOUT': 1,
+            'SOCKET_TIMEOUT': 1,
+            # The cache is an optimization, fall back to the database when
+            # Redis is unavailable instead of failing the request.
+            'IGNORE_EXCEPTIONS': True,
+        },
+    }
+}
+
+# Anonymous recipe list responses, also invalidated by generation counters
+RECIPE_LIST_CACHE_TIMEOUT = 300
+# Recipe details are rebuilt after the first timeout and dropped after the second
+RECIPE_DETAIL_CACHE_TIMEOUT = 60
+RECIPE_DETAIL_STALE_TIMEOUT = 3600
+# Per-process category map, also dropped when another worker changes one
+RECIPE_CATEGORY_CACHE_TIMEOUT = 60
+# Write-behind like buffer: likes are acknowledged from Redis and written
+# to the database by the flush_like_buffer beat task
+RECIPE_LIKE_BUFFER = config('RECIPE_LIKE_BUFFER', default=False, cast=bool)
+RECIPE_LIKE_FLUSH_INTERVAL = 10  # seconds
+# Trending scores: a like's weight halves every half-life
+RECIPE_TRENDING_HALF_LIFE = 6 * 60 * 60  # seconds
+RECIPE_TRENDING_INTERVAL = 60  # seconds
+# Content-addressed media: unreferenced blobs are kept this long, then
+# deleted by the collect_media_blobs beat task
+MEDIA_BLOB_GC_GRACE = 60 * 60  # seconds
+MEDIA_BLOB_GC_INTERVAL = 60 * 60  # seconds
+# Resumable uploads: partial files, the largest accepted upload, how many
+# sessions a user may hold and how long an idle or unclaimed one is kept
+UPLOAD_SESSION_DIR = os.path.join(BASE_DIR, 'upload-sessions')
+UPLOAD_MAX_SIZE = 20 * 1024 * 1024  # bytes
+UPLOAD_MAX_SESSIONS = 10
+UPLOAD_SESSION_TIMEOUT = 24 * 60 * 60  # seconds
+
+# JWT authentication resolves users from a per-process LRU, then Redis,
+# instead of a query per request. See users.authentication
+AUTH_USER_CACHE_TIMEOUT = 5 * 60  # seconds
+AUTH_USER_LOCAL_CACHE_TIMEOUT = 5  # seconds
+AUTH_USER_LOCAL_CACHE_SIZE = 10000
+# Trust the username and is_active claims of access tokens instead
+JWT_STATELESS_USER = config('JWT_STATELESS_USER', default=False, cast=bool)
+# Revoked refresh tokens live in Redis until they expire, optionally
+# fronted by a per-process Bloom filter. See users.blacklist
+JWT_BLACKLIST_BLOOM = config('JWT_BLACKLIST_BLOOM', default=False, cast=bool)
+JWT_BLACKLIST_BLOOM_CAPACITY = 1000000
+JWT_BLACKLIST_BLOOM_ERROR_RATE = 0.001
+JWT_BLACKLIST_BLOOM_SYNC_INTERVAL = 1  # seconds
+
+# Login protection, see users.throttling. A scope set to None is not throttled
+LOGIN_THROTTLE_RATES = {
+    'login_ip': '30/min',
+    'login_email': '10/min',
+}
+LOGIN_HASH_CONCURRENCY = 2  # password checks at once per process
+LOGIN_HASH_QUEUE_TIMEOUT = 2  # seconds a login waits for a slot before a 503
+# Hashes with another count are upgraded on the next successful login
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=260000, cast=int)
+
 # Password reset token lifetime
 DJANGO_REST_MULTITOKENAUTH_RESET_TOKEN_EXPIRY_TIME = 3  # in hours
 
@@ -0,0 +1,15 @@
+"""
+Settings shared by the test suites, applied with override_settings.
+"""
+from fakeredis import FakeConnection
+
+# django-redis talking to an in-process fake Redis
+FAKE_REDIS_CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://localhost:6379/1',
+        'OPTIONS': {
+            'CONNECTION_POOL_KWARGS': {'connection_class': FakeConnection},
+        },
+    }
+}
@@ -0,0 +1,248 @@
+"""
+Response caching for recipe endpoints.
+
+Cached recipe lists are validated with generation tokens instead of being
+deleted on writes. Every entry records the tokens of the scopes it depends
+on: the list it was taken from (all recipes, a category or an author) and
+the category and author of every recipe on the page. A write only replaces
+the tokens of the scopes it touches, so a like on one recipe invalidates
+the pages showing that recipe's category or author and nothing else.
+
+Tokens are random rather than counters, and a scope without one is given
+one before an entry is stored, so a token evicted from Redis can never
+come back with a value an old entry was stored with.
+
+Recipe details are cached per object with a soft and a hard expiry. Once
+the soft expiry passes, a single worker takes a short lock and rebuilds
+the entry while the others keep serving the stale copy.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.utils.http import urlencode
+
+from .models import Recipe
+
+ALL_RECIPES_SCOPE = 'recipe:gen:all'
+LIST_CACHE_PARAMS = (
+    'author__username', 'category__name', 'cursor', 'fields', 'omit', 'page',
+    'page_size', 'pagination',
+)
+DETAIL_LOCK_TIMEOUT = 10
+DETAIL_WAIT_INTERVAL = 0.05
+DETAIL_WAIT_ATTEMPTS = 20
+# Stands in for the data of a recipe that does not exist, for this long
+DETAIL_MISSING = 'missing'
+DETAIL_MISSING_TIMEOUT = 5
+LIST_HITS_KEY = 'recipe:metrics:list:hits'
+LIST_MISSES_KEY = 'recipe:metrics:list:misses'
+
+
+def category_scope(name):
+    return f'recipe:gen:category:{name}'
+
+
+def author_scope(username):
+    return f'recipe:gen:author:{username}'
+
+
+def bump_generations(scopes):
+    """
+    Invalidate every cached entry that depends on one of the scopes.
+    """
+    if scopes:
+        cache.set_many({scope: uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def get_recipe_scopes(category_name, author_username, membership=False):
+    """
+    Scopes touched by a change to a recipe. Creates and deletes change the
+    membership of the unfiltered list as well.
+    """
+    scopes = {category_scope(category_name), author_scope(author_username)}
+    if membership:
+        scopes.add(ALL_RECIPES_SCOPE)
+    return scopes
+
+
+def invalidate_recipes(recipe_ids):
+    """
+    Invalidate the cached lists showing any of the given recipes and mark
+    their cached details as stale.
+    """
+    scopes = set()
+    rows = Recipe.objects.filter(id__in=recipe_ids).values_list(
+        'category__name', 'author__username')
+    for category_name, author_username in rows:
+        scopes |= get_recipe_scopes(category_name, author_username)
+    bump_generations(scopes)
+    expire_recipe_details(recipe_ids)
+
+
+def is_list_cacheable(request):
+    return all(param in LIST_CACHE_PARAMS for param in request.query_params)
+
+
+def get_list_cache_key(request):
+    params = sorted(
+        (param, request.query_params[param])
+        for param in LIST_CACHE_PARAMS if param in request.query_params)
+    digest = hashlib.md5(
+        f'{request.get_host()}?{urlencode(params)}'.encode()).hexdigest()
+    return f'recipe:list:v2:{digest}'
+
+
+def get_list_membership_scopes(request):
+    params = request.query_params
+    scopes = set()
+    if params.get('category__name'):
+        scopes.add(category_scope(params['category__name']))
+    if params.get('author__username'):
+        scopes.add(author_scope(params['author__username']))
+    return scopes or {ALL_RECIPES_SCOPE}
+
+
+def get_cached_list(request):
+    """
+    Returns the cached entry of a recipe list (its response data, the ids of
+    its recipes and its validators), or None.
+    """
+    entry = cache.get(get_list_cache_key(request))
+    if entry is None:
+        return None
+    generations = entry['generations']
+    current = cache.get_many(list(generations))
+    if any(current.get(scope) != token for scope, token in generations.items()):
+        return None
+    return entry
+
+
+def set_cached_list(request, data, recipes, etag, last_modified):
+    """
+    Store response data with the current tokens of the scopes it depends on.
+    The scopes are read from the recipes on the page, as sparse fieldsets
+    may leave the category and author out of the data.
+
+    A write that lands between the database read and this call can go
+    unnoticed until the entry times out, which bounds staleness to
+    RECIPE_LIST_CACHE_TIMEOUT.
+    """
+    scopes = get_list_membership_scopes(request)
+    for recipe in recipes:
+        scopes |= get_recipe_scopes(recipe.category.name, recipe.author.username)
+    current = cache.get_many(list(scopes))
+    missing = scopes - current.keys()
+    if missing:
+        # add() keeps a token another worker seeded meanwhile
+        for scope in missing:
+            cache.add(scope, uuid.uuid4().hex, timeout=None)
+        current.update(cache.get_many(list(missing)))
+    entry = {
+        'generations': {scope: current.get(scope) for scope in scopes},
+        'data': data,
+        'ids': [recipe.pk for recipe in recipes],
+        'etag': etag,
+        'last_modified': last_modified,
+    }
+    cache.set(get_list_cache_key(request), entry,
+              timeout=settings.RECIPE_LIST_CACHE_TIMEOUT)
+
+
+def incr_metric(key):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def record_list_hit():
+    incr_metric(LIST_HITS_KEY)
+
+
+def record_list_miss():
+    incr_metric(LIST_MISSES_KEY)
+
+
+def get_list_cache_stats():
+    counts = cache.get_many([LIST_HITS_KEY, LIST_MISSES_KEY])
+    hits = counts.get(LIST_HITS_KEY, 0)
+    misses = counts.get(LIST_MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def get_detail_keys(pk):
+    key = f'recipe:detail:{pk}'
+    return key, f'{key}:fresh', f'{key}:lock'
+
+
+def get_recipe_detail(pk, build):
+    """
+    Returns the cached detail data of a recipe, calling `build` to compute
+    it when needed. Only the worker holding the lock rebuilds an expired
+    entry, the others serve the stale copy or wait briefly on a cold miss,
+    until the lock is released. A recipe `build` raised Http404 for is
+    remembered as missing for DETAIL_MISSING_TIMEOUT seconds.
+    """
+    data_key, fresh_key, lock_key = get_detail_keys(pk)
+    cached = cache.get_many([data_key, fresh_key])
+    data = cached.get(data_key)
+    if data == DETAIL_MISSING:
+        raise Http404
+    if data is not None and fresh_key in cached:
+        return data
+
+    # add() returns None rather than False when Redis is unreachable, in
+    # which case there is nobody to wait for.
+    acquired = cache.add(lock_key, 1, timeout=DETAIL_LOCK_TIMEOUT)
+    if acquired is not False:
+        try:
+            data = build()
+        except Http404:
+            cache.set(data_key, DETAIL_MISSING, timeout=DETAIL_MISSING_TIMEOUT)
+            raise
+        else:
+            cache.set(data_key, data, timeout=settings.RECIPE_DETAIL_STALE_TIMEOUT)
+            cache.set(fresh_key, 1, timeout=settings.RECIPE_DETAIL_CACHE_TIMEOUT)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    if data is not None:
+        return data
+    for _ in range(DETAIL_WAIT_ATTEMPTS):
+        time.sleep(DETAIL_WAIT_INTERVAL)
+        cached = cache.get_many([data_key, lock_key])
+        data = cached.get(data_key)
+        if data == DETAIL_MISSING:
+            raise Http404
+        if data is not None:
+            return data
+        if lock_key not in cached:
+            # The builder failed without storing anything
+            break
+    return build()
+
+
+def delete_recipe_details(recipe_ids):
+    """
+    Drop cached details, used when the recipe itself changes.
+    """
+    cache.delete_many([
+        key for pk in recipe_ids for key in get_detail_keys(pk)[:2]])
+
+
+def expire_recipe_details(recipe_ids):
+    """
+    Mark cached details as stale, used when only their counters change.
+    """
+    cache.delete_many([get_detail_keys(pk)[1] for pk in recipe_ids])
@@ -0,0 +1,140 @@
+"""
+Caches of recipe categories.
+
+Every worker keeps the category names and ids in memory and reloads them
+after RECIPE_CATEGORY_CACHE_TIMEOUT seconds. A change to a category
+replaces a version token in Redis. Workers compare it with the version
+they loaded at most every VERSION_CHECK_INTERVAL seconds, so they reload
+at most that often and shortly after any change.
+
+Recipe counts change with every recipe write, so they are kept apart in
+Redis, one key per category. A write drops the keys of the categories it
+touched and the next listing counts only those again.
+"""
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Recipe, RecipeCategory
+
+VERSION_KEY = 'recipe:categories:version'
+COUNT_KEY = 'recipe:categories:count:{}'
+VERSION_CHECK_INTERVAL = 1
+
+
+class CategoryCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.categories = None
+        self.loaded_at = 0
+        self.checked_at = 0
+        self.version = None
+
+    def is_current(self, now):
+        if self.categories is None:
+            return False
+        if now - self.loaded_at > settings.RECIPE_CATEGORY_CACHE_TIMEOUT:
+            return False
+        if now - self.checked_at > VERSION_CHECK_INTERVAL:
+            self.checked_at = now
+            return cache.get(VERSION_KEY) == self.version
+        return True
+
+    def load(self, now):
+        version = cache.get(VERSION_KEY)
+        rows = RecipeCategory.objects.order_by('name').values_list('name', 'id')
+        self.categories = dict(rows)
+        self.version = version
+        self.loaded_at = self.checked_at = now
+
+    def get(self):
+        """
+        Returns {name: id}, ordered by name.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not self.is_current(now):
+                self.load(now)
+            return self.categories
+
+
+categories = CategoryCache()
+
+
+def get_category_counts(category_ids):
+    """
+    Returns {id: number of recipes}, counting only the categories whose
+    count is not cached.
+    """
+    keys = {category_id: COUNT_KEY.format(category_id) for category_id in category_ids}
+    cached = cache.get_many(list(keys.values()))
+    counts = {category_id: cached[key] for category_id, key in keys.items() if key in cached}
+    missing = keys.keys() - counts.keys()
+    if missing:
+        counted = dict.fromkeys(missing, 0)
+        # order_by() keeps Meta.ordering out of the GROUP BY
+        rows = Recipe.objects.filter(category_id__in=missing).order_by().values(
+            'category_id').annotate(count=Count('id'))
+        counted.update((row['category_id'], row['count']) for row in rows)
+        cache.set_many({keys[category_id]: count for category_id, count in counted.items()},
+                       timeout=settings.RECIPE_CATEGORY_CACHE_TIMEOUT)
+        counts.update(counted)
+    return counts
+
+
+def invalidate_category_counts(category_ids):
+    cache.delete_many([COUNT_KEY.format(category_id) for category_id in category_ids])
+
+
+def get_categories():
+    """
+    Returns every category with its number of recipes, ordered by name.
+    """
+    cached = categories.get()
+    counts = get_category_counts(cached.values())
+    return [{'id': category_id, 'name': name, 'number_of_recipes': counts[category_id]}
+            for name, category_id in cached.items()]
+
+
+def invalidate_categories():
+    """
+    Drop the cached categories in this worker now and in the others
+    within VERSION_CHECK_INTERVAL.
+    """
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+    categories.clear()
+
+
+def get_category_ids(names):
+    """
+    Map category names to ids, creating the missing categories.
+    """
+    cached = categories.get()
+    category_ids = {name: cached[name] for name in names if name in cached}
+    missing = set(names) - category_ids.keys()
+    if missing:
+        # The unique index makes concurrent creates of a name safe
+        RecipeCategory.objects.bulk_create(
+            [RecipeCategory(name=name) for name in missing], ignore_conflicts=True)
+        category_ids.update(RecipeCategory.objects.filter(
+            name__in=missing).values_list('name', 'id'))
+        # Only once they are committed: a reload inside this transaction
+        # would keep their ids cached if it rolled back
+        transaction.on_commit(invalidate_categories)
+    return category_ids
+
+
+def get_category(name):
+    """
+    Returns the category with the given name, created if needed, without
+    a query when it is cached.
+    """
+    return RecipeCategory(id=get_category_ids([name])[name], name=name)
@@ -0,0 +1,103 @@
+"""
+Streaming export of every recipe as NDJSON or CSV.
+
+Rows are read through a server-side cursor (`.iterator(chunk_size=...)`),
+encoded one at a time and yielded in buffered chunks, optionally gzipped
+on the fly, so memory use does not grow with the size of the table.
+"""
+import csv
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Recipe
+
+DEFAULT_CHUNK_SIZE = 2000
+# Bytes collected before a chunk is yielded to the response or file
+BUFFER_SIZE = 64 * 1024
+# (column name, model field path)
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('title', 'title'),
+    ('desc', 'desc'),
+    ('category', 'category__name'),
+    ('author', 'author_id'),
+    ('username', 'author__username'),
+    ('picture', 'picture'),
+    ('cook_time', 'cook_time'),
+    ('ingredients', 'ingredients'),
+    ('procedure', 'procedure'),
+    ('number_of_likes', 'number_of_likes'),
+    ('number_of_bookmarks', 'number_of_bookmarks'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+class LineBuffer:
+    """
+    File-like target that makes csv.writer return each line it writes.
+    """
+    def write(self, line):
+        return line
+
+
+def iter_rows(chunk_size=DEFAULT_CHUNK_SIZE):
+    rows = Recipe.objects.order_by('id').values_list(
+        *[path for _, path in EXPORT_COLUMNS])
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def iter_ndjson(rows):
+    names = [name for name, _ in EXPORT_COLUMNS]
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(names, row))) + '\n'
+
+
+def iter_csv(rows):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def buffer_lines(lines, size=BUFFER_SIZE):
+    chunk = []
+    length = 0
+    for line in lines:
+        data = line.encode()
+        chunk.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_recipes(output='ndjson', compress=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the encoded export as byte chunks.
+    """
+    rows = iter_rows(chunk_size)
+    lines = iter_csv(rows) if output == 'csv' else iter_ndjson(rows)
+    chunks = buffer_lines(lines)
+    if compress:
+        chunks = gzip_chunks(chunks)
+    return chunks
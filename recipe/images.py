@@ -0,0 +1,191 @@
+"""
+Image variants for recipe pictures and avatars.
+
+Uploads are stored as they arrive and processed by a Celery task once the
+request's transaction commits, so no image work happens while the client
+waits. The task rotates the original upright and re-encodes it without
+its EXIF data, then writes a JPEG and a WebP copy at each fixed width
+below the original's. The result is recorded next to the image field as
+
+    {'width': w, 'height': h, 'sources': {'jpeg': [[320, path], ...], 'webp': [...]}}
+
+and served as one srcset string per format. Until the task has run the
+variants are empty and clients fall back to the original.
+"""
+import logging
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+from kombu.exceptions import OperationalError
+from PIL import Image, ImageOps
+
+from .cache import delete_recipe_details, invalidate_recipes
+from .models import Recipe
+from .storage import media_storage, release_files
+
+RECIPE_PICTURE_WIDTHS = (320, 640, 1280)
+AVATAR_WIDTHS = (64, 128, 256)
+# srcset key: (Pillow format, file extension)
+VARIANT_FORMATS = {'jpeg': ('JPEG', 'jpg'), 'webp': ('WEBP', 'webp')}
+VARIANT_QUALITY = 80
+ORIGINAL_QUALITY = 90
+
+logger = logging.getLogger(__name__)
+
+
+def open_image(field_file):
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        image.load()
+    finally:
+        field_file.close()
+    return image
+
+
+def encode(image, format, quality, icc_profile=None):
+    """
+    Returns the image encoded as `format`. Nothing of the source's metadata
+    is written but its colour profile.
+    """
+    if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    options = {'quality': quality} if format in ('JPEG', 'WEBP') else {}
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    buffer = BytesIO()
+    image.save(buffer, format, **options)
+    return buffer.getvalue()
+
+
+def get_variant_widths(width, widths):
+    return [size for size in widths if size < width] or [width]
+
+
+def get_image_files(name, variants):
+    """
+    Returns the stored files of an image and of its variants.
+    """
+    files = [name] if name else []
+    for sources in (variants or {}).get('sources', {}).values():
+        files.extend(path for _, path in sources)
+    return files
+
+
+def process_image(field_file, widths):
+    """
+    Strip the EXIF data of a stored image and write its variants. Returns
+    the name of the cleaned original, the variants and every file written.
+    """
+    storage = field_file.storage
+    image = open_image(field_file)
+    # Camera JPEGs with a preview image open as MPO, which Pillow cannot write
+    source_format = 'JPEG' if image.format == 'MPO' else image.format
+    has_exif = bool(image.getexif())
+    icc_profile = image.info.get('icc_profile')
+    image = ImageOps.exif_transpose(image)
+
+    name = field_file.name
+    written = []
+    if has_exif:
+        # Saved next to the original, which is deleted once no row uses it
+        name = storage.save(name, ContentFile(
+            encode(image, source_format, ORIGINAL_QUALITY, icc_profile)))
+        written.append(name)
+
+    directory, filename = os.path.split(field_file.name)
+    stem = os.path.splitext(filename)[0]
+    sources = {key: [] for key in VARIANT_FORMATS}
+    for width in get_variant_widths(image.width, widths):
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        for key, (format, extension) in VARIANT_FORMATS.items():
+            path = storage.save(
+                os.path.join(directory, 'variants', f'{stem}_{width}.{extension}'),
+                ContentFile(encode(resized, format, VARIANT_QUALITY, icc_profile)))
+            written.append(path)
+            sources[key].append([width, path])
+    return name, {'width': image.width, 'height': image.height, 'sources': sources}, written
+
+
+def process_stored_image(model, pk, field_name, name, widths, **fields):
+    """
+    Process the image `name` held by `field_name` of row `pk` and record
+    the result in `<field_name>_variants`, along with `fields`. Does
+    nothing when the row was deleted or given another image meanwhile.
+    Returns whether the row was updated.
+    """
+    row = model.objects.filter(pk=pk).only(field_name).first()
+    if row is None or getattr(row, field_name).name != name:
+        return False
+    field_file = getattr(row, field_name)
+    new_name, variants, written = process_image(field_file, widths)
+    updated = model.objects.filter(pk=pk, **{field_name: name}).update(
+        **{field_name: new_name, f'{field_name}_variants': variants}, **fields)
+    if not updated:
+        field_file.storage.delete_many(written)
+    elif new_name != name:
+        # `name` was read from the row above
+        release_files([name], model, field_name)
+    return bool(updated)
+
+
+def process_recipe_picture(recipe_id, name):
+    """
+    Process a recipe's picture. Moving updated_at changes the recipe's
+    validators, so clients and caches pick up the new URLs.
+    """
+    updated = process_stored_image(
+        Recipe, recipe_id, 'picture', name, RECIPE_PICTURE_WIDTHS, updated_at=timezone.now())
+    if updated:
+        invalidate_recipes([recipe_id])
+        delete_recipe_details([recipe_id])
+    return updated
+
+
+def process_on_commit(task, *args):
+    """
+    Queue `task` once the current transaction commits. A broker outage
+    leaves the image unprocessed rather than failing the request, the
+    `process_images` command catches up on those.
+    """
+    def send():
+        try:
+            task.delay(*args)
+        except OperationalError:
+            logger.exception('Could not queue %s%r', task.name, args)
+
+    transaction.on_commit(send)
+
+
+def get_srcset(variants, build_url=None):
+    """
+    Returns {'width', 'height', 'srcset': {format: srcset}} for stored
+    variants, or {} before they are processed.
+    """
+    if not variants:
+        return {}
+    srcset = {}
+    for key, sources in variants['sources'].items():
+        urls = ((media_storage.url(path), width) for width, path in sources)
+        srcset[key] = ', '.join(
+            f'{build_url(url) if build_url else url} {width}w' for url, width in urls)
+    return {'width': variants['width'], 'height': variants['height'], 'srcset': srcset}
+
+
+def make_srcset_absolute(value, build_url):
+    """
+    Rewrite the relative URLs of a `get_srcset` result. Storage URLs are
+    percent-encoded, so they hold no ', ' or ' ' of their own.
+    """
+    if not value:
+        return value
+    srcset = {}
+    for key, candidates in value['srcset'].items():
+        srcset[key] = ', '.join(
+            f'{build_url(url)} {descriptor}'
+            for url, descriptor in (candidate.rsplit(' ', 1) for candidate in candidates.split(', ')))
+    return {**value, 'srcset': srcset}
@@ -0,0 +1,174 @@
+"""
+Bulk recipe import from NDJSON (one JSON object per line).
+
+Rows are validated one at a time against a single serializer instance and
+collected into batches. Each batch resolves its categories through the
+category cache, is inserted with `bulk_create` in its own transaction and
+is then indexed for search and ingredients, since `bulk_create` fires no
+signals. The pictures are processed by Celery once a batch commits.
+Invalid rows are reported by line number and do not abort their batch.
+
+A row's picture is either `picture`, the name of a blob already in the
+media storage, or `upload`, a completed upload session of the importing
+user. Arbitrary storage paths are refused, as the recipe would otherwise
+take over, and later release, a file it never owned.
+"""
+import json
+
+from django.db import connection, transaction
+from rest_framework import serializers
+
+from .cache import bump_generations, get_recipe_scopes
+from .categories import get_category_ids, invalidate_category_counts
+from .images import process_on_commit
+from .ingredients import index_recipe_ingredients
+from .models import MediaBlob, Recipe, UploadSession
+from .search import index_recipes
+from .storage import BLOB_PREFIX, retain
+from .tasks import process_recipe_picture
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+
+class RecipeImportSerializer(serializers.ModelSerializer):
+    """
+    One NDJSON row, with either `picture`, a stored blob name, or `upload`,
+    the id of a completed upload session. Both are resolved per batch.
+    """
+    category = serializers.CharField(max_length=100)
+    picture = serializers.CharField(max_length=100, required=False)
+    upload = serializers.UUIDField(required=False)
+
+    class Meta:
+        model = Recipe
+        fields = ('category', 'picture', 'upload', 'title', 'desc', 'cook_time',
+                  'ingredients', 'procedure')
+
+    def validate_picture(self, value):
+        if not value.startswith(BLOB_PREFIX):
+            raise serializers.ValidationError(f'Must be a stored name under {BLOB_PREFIX}.')
+        return value
+
+    def validate(self, data):
+        if ('picture' in data) == ('upload' in data):
+            raise serializers.ValidationError('Provide either `picture` or `upload`.')
+        return data
+
+
+def resolve_pictures(entries, author, fail):
+    """
+    Lock the blobs and upload sessions the rows of `entries`, pairs of line
+    number and row, refer to and set each row's picture. Rows whose blob
+    or session does not exist are failed. Returns the rows left, the blob
+    names they take a new reference to and the ids of the sessions they
+    claim. Must run inside the batch's transaction.
+    """
+    names = {row['picture'] for _, row in entries if 'picture' in row}
+    # Locked rows are skipped by the collector until the batch commits
+    stored = set(MediaBlob.objects.select_for_update().filter(
+        name__in=names).values_list('name', flat=True))
+    session_ids = {row['upload'] for _, row in entries if 'upload' in row}
+    sessions = dict(UploadSession.objects.select_for_update().filter(
+        pk__in=session_ids, user=author).exclude(name='').values_list('pk', 'name'))
+
+    rows = []
+    retained = []
+    claimed = set()
+    for number, row in entries:
+        if 'upload' in row:
+            session_id = row.pop('upload')
+            if session_id not in sessions or session_id in claimed:
+                fail(number, {'upload': ['No completed upload with this id.']})
+                continue
+            claimed.add(session_id)
+            row['picture'] = sessions[session_id]
+        elif row['picture'] in stored:
+            retained.append(row['picture'])
+        else:
+            fail(number, {'picture': ['No stored file with this name.']})
+            continue
+        rows.append(row)
+    return rows, retained, claimed
+
+
+def create_recipes(entries, author, fail):
+    """
+    Insert a batch of validated rows, pairs of line number and row, in one
+    transaction. Returns the number of recipes created.
+    """
+    with transaction.atomic():
+        rows, retained, claimed = resolve_pictures(entries, author, fail)
+        if not rows:
+            return 0
+        category_ids = get_category_ids({row['category'] for row in rows})
+        recipes = [
+            Recipe(author=author, category_id=category_ids[row['category']],
+                   **{key: value for key, value in row.items() if key != 'category'})
+            for row in rows
+        ]
+        # Stored blobs gain a reference, an upload hands its own over
+        retain(retained)
+        UploadSession.objects.filter(pk__in=claimed).delete()
+        if connection.features.can_return_rows_from_bulk_insert:
+            recipes = Recipe.objects.bulk_create(recipes)
+            index_recipes(recipes)
+            index_recipe_ingredients(recipes)
+            scopes = set()
+            for name in category_ids:
+                scopes |= get_recipe_scopes(name, author.username, membership=True)
+            transaction.on_commit(lambda: bump_generations(scopes))
+            transaction.on_commit(
+                lambda: invalidate_category_counts(category_ids.values()))
+        else:
+            # Without ids back from the insert, fall back to saving each
+            # row and let the signals index it.
+            for recipe in recipes:
+                recipe.save()
+        for recipe in recipes:
+            process_on_commit(process_recipe_picture, recipe.pk, recipe.picture.name)
+    return len(recipes)
+
+
+def import_recipes(lines, author, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Import recipes from an iterable of NDJSON lines (str or bytes) on
+    behalf of `author`. Returns a report with the number of created and
+    failed rows and the errors of the first failed ones.
+    """
+    report = {'created': 0, 'failed': 0, 'errors': []}
+    validator = RecipeImportSerializer()
+    batch = []
+
+    def fail(number, errors):
+        report['failed'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': number, 'errors': errors})
+
+    def flush():
+        report['created'] += create_recipes(batch, author, fail)
+        batch.clear()
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            fail(number, {'non_field_errors': ['Invalid JSON.']})
+            continue
+        if not isinstance(row, dict):
+            fail(number, {'non_field_errors': ['Expected a JSON object.']})
+            continue
+        try:
+            batch.append((number, validator.run_validation(row)))
+        except serializers.ValidationError as exc:
+            fail(number, exc.detail)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    # Rows failed on resolving their picture are reported with their batch
+    report['errors'].sort(key=lambda error: error['line'])
+    return report
@@ -0,0 +1,131 @@
+"""
+Ingredient parsing and the "cook with what I have" query engine.
+
+Recipe.ingredients is free text, so on save it is parsed into normalized
+`Ingredient` names and stored as `RecipeIngredient` postings. Queries fetch
+the posting lists of the supplied ingredients in one indexed query and
+merge them by recipe id to count how many ingredients each recipe covers.
+"""
+import heapq
+import re
+from itertools import groupby
+
+from django.db import transaction
+
+from .models import Ingredient, RecipeIngredient
+
+SEPARATOR_RE = re.compile(r'[,;\n]+|\s+and\s+|\s+&\s+')
+PARENTHESES_RE = re.compile(r'\([^)]*\)')
+WORD_RE = re.compile(r'[^\W\d_]+')
+MAX_NAME_LENGTH = 100
+
+UNITS = frozenset((
+    'bunch', 'can', 'clove', 'cup', 'dash', 'drop', 'g', 'gallon', 'gram',
+    'handful', 'kg', 'kilogram', 'l', 'lb', 'lbs', 'liter', 'litre', 'mg',
+    'ml', 'oz', 'ounce', 'packet', 'piece', 'pinch', 'pint', 'pound', 'quart',
+    'slice', 'sprig', 'stick', 'tablespoon', 'tbsp', 'teaspoon', 'tsp',
+))
+DESCRIPTORS = frozenset((
+    'a', 'about', 'chopped', 'cold', 'crushed', 'diced', 'dried', 'few',
+    'finely', 'fresh', 'freshly', 'grated', 'ground', 'large', 'medium',
+    'melted', 'minced', 'of', 'optional', 'peeled', 'some', 'sliced',
+    'small', 'softened', 'taste', 'to', 'warm', 'whole',
+))
+
+
+def singularize(word):
+    if len(word) <= 3 or word.endswith(('ss', 'us', 'is')):
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('oes'):
+        return word[:-2]
+    if word.endswith('s'):
+        return word[:-1]
+    return word
+
+
+def normalize_ingredient(text):
+    """
+    Reduce an ingredient line such as "2 cups chopped Tomatoes" to "tomato".
+    """
+    words = [
+        singularize(word) for word in WORD_RE.findall(
+            PARENTHESES_RE.sub(' ', text.lower()))
+    ]
+    words = [word for word in words
+             if word not in UNITS and word not in DESCRIPTORS]
+    return ' '.join(words)[:MAX_NAME_LENGTH].strip()
+
+
+def parse_ingredients(text):
+    """
+    Returns the set of normalized ingredient names in a free-text list.
+    """
+    names = (normalize_ingredient(part) for part in SEPARATOR_RE.split(text or ''))
+    return {name for name in names if name}
+
+
+def get_ingredient_ids(names, create=False):
+    """
+    Map normalized names to Ingredient ids, optionally creating missing ones.
+    """
+    ids = dict(Ingredient.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = set(names) - set(ids)
+    if create and missing:
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name) for name in missing], ignore_conflicts=True)
+        ids.update(Ingredient.objects.filter(name__in=missing).values_list('name', 'id'))
+    return ids
+
+
+def index_recipe_ingredients(recipes):
+    """
+    (Re)build the ingredient postings of the given recipes.
+    """
+    parsed = {recipe.pk: parse_ingredients(recipe.ingredients) for recipe in recipes}
+    with transaction.atomic():
+        ids = get_ingredient_ids(set().union(*parsed.values()), create=True)
+        RecipeIngredient.objects.filter(recipe_id__in=parsed).delete()
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(ingredient_id=ids[name], recipe_id=recipe_id,
+                             recipe_ingredient_count=len(names))
+            for recipe_id, names in parsed.items()
+            for name in names
+        ], batch_size=1000)
+
+
+def find_recipes_by_ingredients(names, max_missing=2):
+    """
+    Rank recipes by how well the supplied ingredients cover them.
+
+    Returns `(recipe_id, matched, missing)` tuples for recipes that use at
+    least one of the ingredients and lack at most `max_missing` others,
+    fewest missing first, then most matched, newest first.
+    """
+    ingredient_ids = get_ingredient_ids({normalize_ingredient(name) for name in names})
+    if not ingredient_ids:
+        return []
+
+    # A recipe with more than matched + max_missing ingredients can never
+    # qualify, which prunes most of the long posting lists in SQL.
+    postings = RecipeIngredient.objects.filter(
+        ingredient_id__in=ingredient_ids.values(),
+        recipe_ingredient_count__lte=len(ingredient_ids) + max_missing,
+    ).order_by('ingredient_id', 'recipe_id').values_list(
+        'ingredient_id', 'recipe_id', 'recipe_ingredient_count')
+    posting_lists = [
+        [(recipe_id, count) for _, recipe_id, count in rows]
+        for _, rows in groupby(postings.iterator(), key=lambda row: row[0])
+    ]
+
+    results = []
+    merged = heapq.merge(*posting_lists)
+    for recipe_id, rows in groupby(merged, key=lambda row: row[0]):
+        rows = list(rows)
+        matched = len(rows)
+        missing = rows[0][1] - matched
+        if missing <= max_missing:
+            results.append((recipe_id, matched, missing))
+    results.sort(key=lambda row: (row[2], -row[1], -row[0]))
+    return results
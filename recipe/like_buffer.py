@@ -0,0 +1,289 @@
+"""
+Optional write-behind buffer for likes, enabled by RECIPE_LIKE_BUFFER.
+
+Likes and unlikes are recorded in Redis and acknowledged at once. The
+`flush_like_buffer` beat task applies them to RecipeLike in batches.
+Reads merge the unflushed state, so like counts stay exact.
+
+Redis keys:
+    likes:pending:<recipe>   hash user id -> 1 (like) or 0 (unlike), the
+                             last write of a user wins
+    likes:dirty              recipe ids with a pending hash
+    likes:flushing:<recipe>  pending hash taken over by a flush
+    likes:flushing           recipe ids with a flushing hash
+    likes:version            bumped on every write, folded into ETags
+    likes:flush-lock         token of the running flush
+
+Crash recovery: a flush moves pending hashes to flushing ones in a single
+MULTI, applies them in one database transaction and deletes them only
+after the commit. Applying is idempotent (likes are inserted ignoring
+conflicts, unlikes deleted and counters recounted), and every flush starts
+by applying the flushing hashes left over by a previous one. A flush that
+dies at any point is therefore completed by the next one, and newer
+pending writes are always applied after the older flushing ones. Writes
+acknowledged by the buffer are only lost if Redis itself loses them.
+
+One flush runs at a time. It holds a lock with a token of its own, stops
+taking new batches after FLUSH_TIME_BUDGET, well before the lock expires,
+and releases the lock only if it still holds that token.
+"""
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError, WatchError
+
+from .cache import invalidate_recipes
+from .conditional import make_etag
+from .models import Recipe, RecipeLike, count_likes_subquery
+
+KEY_PREFIX = 'recipe-api:likes'
+DIRTY_KEY = f'{KEY_PREFIX}:dirty'
+FLUSHING_KEY = f'{KEY_PREFIX}:flushing'
+VERSION_KEY = f'{KEY_PREFIX}:version'
+FLUSH_LOCK_KEY = f'{KEY_PREFIX}:flush-lock'
+FLUSH_LOCK_TIMEOUT = 300
+# Seconds after which a flush takes no new batch, leaving time for the
+# batch in progress before the lock expires
+FLUSH_TIME_BUDGET = 120
+FLUSH_BATCH_SIZE = 1000
+MAX_FLUSH_BATCHES = 100
+
+
+def is_enabled():
+    return settings.RECIPE_LIKE_BUFFER
+
+
+def get_client():
+    return get_redis_connection('default')
+
+
+def pending_key(recipe_id):
+    return f'{KEY_PREFIX}:pending:{recipe_id}'
+
+
+def flushing_key(recipe_id):
+    return f'{KEY_PREFIX}:flushing:{recipe_id}'
+
+
+def record_like(user_id, recipe_id, liked=True):
+    """
+    Buffer a like (or an unlike). Raises RedisError when Redis is down.
+    """
+    pipe = get_client().pipeline()
+    pipe.hset(pending_key(recipe_id), user_id, int(liked))
+    pipe.sadd(DIRTY_KEY, recipe_id)
+    pipe.incr(VERSION_KEY)
+    pipe.execute()
+
+
+def get_pending_states(recipe_ids):
+    """
+    Returns {recipe_id: {user_id: liked}} of the unflushed writes.
+    """
+    recipe_ids = list(recipe_ids)
+    if not recipe_ids:
+        return {}
+    pipe = get_client().pipeline(transaction=False)
+    for recipe_id in recipe_ids:
+        pipe.hgetall(flushing_key(recipe_id))
+        pipe.hgetall(pending_key(recipe_id))
+    hashes = pipe.execute()
+    states = {}
+    for index, recipe_id in enumerate(recipe_ids):
+        # Pending writes are newer than the ones being flushed
+        merged = {**hashes[2 * index], **hashes[2 * index + 1]}
+        if merged:
+            states[recipe_id] = {
+                int(user_id): liked == b'1' for user_id, liked in merged.items()}
+    return states
+
+
+def get_like_deltas(recipe_ids):
+    """
+    Returns {recipe_id: delta} to add to the stored like counters.
+    """
+    states = get_pending_states(recipe_ids)
+    if not states:
+        return {}
+    user_ids = {user_id for users in states.values() for user_id in users}
+    stored = set(RecipeLike.objects.filter(
+        recipe_id__in=states, user_id__in=user_ids).values_list('recipe_id', 'user_id'))
+    deltas = {}
+    for recipe_id, users in states.items():
+        delta = sum(int(liked) - ((recipe_id, user_id) in stored)
+                    for user_id, liked in users.items())
+        if delta:
+            deltas[recipe_id] = delta
+    return deltas
+
+
+def get_user_states(user_id, recipe_ids):
+    """
+    Returns {recipe_id: liked} of a user's unflushed writes.
+    """
+    recipe_ids = list(recipe_ids)
+    if not is_enabled() or not recipe_ids:
+        return {}
+    try:
+        pipe = get_client().pipeline(transaction=False)
+        for recipe_id in recipe_ids:
+            pipe.hget(flushing_key(recipe_id), user_id)
+            pipe.hget(pending_key(recipe_id), user_id)
+        values = pipe.execute()
+    except RedisError:
+        return {}
+    states = {}
+    for index, recipe_id in enumerate(recipe_ids):
+        flushing, pending = values[2 * index], values[2 * index + 1]
+        value = pending if pending is not None else flushing
+        if value is not None:
+            states[recipe_id] = value == b'1'
+    return states
+
+
+def merge_like_counts(items):
+    """
+    Add the unflushed likes to serialized recipes, in place.
+    """
+    if not is_enabled():
+        return items
+    items = [item for item in items
+             if 'id' in item and 'total_number_of_likes' in item]
+    try:
+        deltas = get_like_deltas([item['id'] for item in items])
+    except RedisError:
+        return items
+    for item in items:
+        item['total_number_of_likes'] += deltas.get(item['id'], 0)
+    return items
+
+
+def add_buffer_version(validators):
+    """
+    Fold the buffer version into an ETag, as buffered likes do not move
+    Recipe.updated_at until they are flushed.
+    """
+    if not is_enabled():
+        return validators
+    etag, last_modified = validators
+    try:
+        version = get_client().get(VERSION_KEY)
+    except RedisError:
+        return validators
+    if version:
+        etag = make_etag(etag, version.decode())
+    return etag, last_modified
+
+
+def take_pending(client, recipe_ids):
+    """
+    Move the pending hashes of the recipes to flushing ones.
+    """
+    pipe = client.pipeline()
+    pipe.srem(DIRTY_KEY, *recipe_ids)
+    for recipe_id in recipe_ids:
+        pipe.rename(pending_key(recipe_id), flushing_key(recipe_id))
+    pipe.sadd(FLUSHING_KEY, *recipe_ids)
+    # A recipe may have no pending hash left, its RENAME fails alone
+    pipe.execute(raise_on_error=False)
+
+
+def apply_likes(likes, unlikes):
+    """
+    Write (recipe_id, user_id) likes and unlikes and recount the recipes.
+    """
+    recipe_ids = {recipe_id for recipe_id, _ in likes + unlikes}
+    with transaction.atomic():
+        recipe_ids = set(Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+        user_ids = set(get_user_model().objects.filter(
+            id__in={user_id for _, user_id in likes}).values_list('id', flat=True))
+        RecipeLike.objects.bulk_create([
+            RecipeLike(recipe_id=recipe_id, user_id=user_id)
+            for recipe_id, user_id in likes
+            if recipe_id in recipe_ids and user_id in user_ids
+        ], batch_size=FLUSH_BATCH_SIZE, ignore_conflicts=True)
+
+        unliked = {}
+        for recipe_id, user_id in unlikes:
+            unliked.setdefault(recipe_id, []).append(user_id)
+        condition = Q()
+        for recipe_id, users in unliked.items():
+            condition |= Q(recipe_id=recipe_id, user_id__in=users)
+        if condition:
+            RecipeLike.objects.filter(condition).delete()
+
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            number_of_likes=count_likes_subquery(), updated_at=timezone.now())
+        transaction.on_commit(lambda: invalidate_recipes(recipe_ids))
+
+
+def apply_flushing(client):
+    """
+    Apply every flushing hash to the database, then delete them.
+    """
+    recipe_ids = [int(recipe_id) for recipe_id in client.smembers(FLUSHING_KEY)]
+    if not recipe_ids:
+        return 0
+    pipe = client.pipeline(transaction=False)
+    for recipe_id in recipe_ids:
+        pipe.hgetall(flushing_key(recipe_id))
+    likes, unlikes = [], []
+    for recipe_id, users in zip(recipe_ids, pipe.execute()):
+        for user_id, liked in users.items():
+            (likes if liked == b'1' else unlikes).append((recipe_id, int(user_id)))
+    apply_likes(likes, unlikes)
+
+    pipe = client.pipeline()
+    pipe.delete(*[flushing_key(recipe_id) for recipe_id in recipe_ids])
+    pipe.srem(FLUSHING_KEY, *recipe_ids)
+    pipe.execute()
+    return len(recipe_ids)
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """
+    Apply the buffered likes to the database. Returns the number of
+    recipes flushed.
+    """
+    client = get_client()
+    token = uuid.uuid4().hex
+    if not client.set(FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_TIMEOUT):
+        return 0
+    deadline = time.monotonic() + FLUSH_TIME_BUDGET
+    try:
+        # Finish whatever a previous flush left behind first
+        flushed = apply_flushing(client)
+        for _ in range(MAX_FLUSH_BATCHES):
+            if time.monotonic() > deadline:
+                break
+            recipe_ids = [int(recipe_id) for recipe_id in
+                          client.srandmember(DIRTY_KEY, batch_size)]
+            if not recipe_ids:
+                break
+            take_pending(client, recipe_ids)
+            flushed += apply_flushing(client)
+        return flushed
+    finally:
+        release_flush_lock(client, token)
+
+
+def release_flush_lock(client, token):
+    """
+    Delete the flush lock if it still holds `token`.
+    """
+    with client.pipeline() as pipe:
+        try:
+            pipe.watch(FLUSH_LOCK_KEY)
+            if pipe.get(FLUSH_LOCK_KEY) == token.encode():
+                pipe.multi()
+                pipe.delete(FLUSH_LOCK_KEY)
+                pipe.execute()
+        except WatchError:
+            # Expired and taken by another flush meanwhile
+            pass
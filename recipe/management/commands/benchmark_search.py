@@ -0,0 +1,127 @@
+import random
+import statistics
+import time
+from datetime import time as cook_time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from recipe.models import Recipe, RecipeCategory
+from recipe.search import FIELD_WEIGHTS, index_recipes, search_recipes
+
+VOCABULARY = (
+    'almond apple bacon basil bean beef bread broccoli butter cabbage carrot '
+    'cauliflower cheddar cheese chicken chickpea chili chocolate cinnamon '
+    'coconut cod coriander corn cream cucumber cumin curry dill egg eggplant '
+    'fennel feta flour garlic ginger honey kale lamb leek lemon lentil lime '
+    'mango maple milk mint mushroom mustard noodle nutmeg oat olive onion '
+    'orange oregano paprika parsley pasta peanut pear pepper pesto pork '
+    'potato pumpkin quinoa radish rice rosemary saffron salmon salt sausage '
+    'sesame shrimp spinach squash sugar thyme tofu tomato tuna turmeric '
+    'vanilla vinegar walnut yogurt zucchini'
+).split()
+METHODS = (
+    'bake boil braise chop dice fry grill knead marinate mash mix poach '
+    'roast saute simmer steam stir whisk'
+).split()
+QUERIES = (
+    'garlic', 'chicken curry', 'chocolate vanilla cake', 'roast potato rosemary',
+    'lemon', 'spicy shrimp noodle', 'mango lime',
+)
+SEARCH_FIELDS = [field for field, _ in FIELD_WEIGHTS]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic recipe corpus and compare the inverted-index '
+            'search against icontains filtering. Rolled back unless --keep.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=500000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true',
+                            help='Commit the seeded corpus instead of rolling back.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.seed(options['recipes'], options['batch_size'])
+                self.benchmark(options['repeat'], options['limit'])
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('Seeded corpus rolled back.')
+
+    def sentence(self, words, vocabulary):
+        return ' '.join(self.random.choice(vocabulary) for _ in range(words))
+
+    def seed(self, total, batch_size):
+        author, _ = get_user_model().objects.get_or_create(
+            email='benchmark@example.com', defaults={'username': 'benchmark'})
+        category, _ = RecipeCategory.objects.get_or_create(name='Benchmark')
+        last_id = Recipe.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+        started = time.perf_counter()
+        for start in range(0, total, batch_size):
+            Recipe.objects.bulk_create([
+                Recipe(
+                    author=author, category=category, picture='uploads/benchmark.jpg',
+                    title=self.sentence(3, VOCABULARY).title(),
+                    desc=self.sentence(8, VOCABULARY),
+                    cook_time=cook_time(hour=1),
+                    ingredients=', '.join(self.random.sample(VOCABULARY, 8)),
+                    procedure=' '.join(
+                        f'{self.random.choice(METHODS)} the {self.random.choice(VOCABULARY)}.'
+                        for _ in range(12)),
+                )
+                for _ in range(min(batch_size, total - start))
+            ])
+        self.stdout.write(f'Seeded {total} recipes in {time.perf_counter() - started:.1f}s')
+
+        # bulk_create skips the signals, so index the new rows explicitly
+        started = time.perf_counter()
+        seeded = Recipe.objects.filter(id__gt=last_id).only(*SEARCH_FIELDS).order_by()
+        batch = []
+        for recipe in seeded.iterator(chunk_size=batch_size):
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                index_recipes(batch)
+                batch = []
+        if batch:
+            index_recipes(batch)
+        self.stdout.write(f'Indexed in {time.perf_counter() - started:.1f}s')
+
+    def time_query(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def benchmark(self, repeat, limit):
+        self.stdout.write(f'{"query":<28}{"index (ms)":>12}{"icontains (ms)":>16}')
+        for query in QUERIES:
+            def indexed():
+                ids = [row['recipe_id'] for row in search_recipes(query)[:limit]]
+                return list(Recipe.objects.filter(id__in=ids))
+
+            def icontains():
+                condition = Q()
+                for word in query.split():
+                    for field in SEARCH_FIELDS:
+                        condition |= Q(**{f'{field}__icontains': word})
+                return list(Recipe.objects.filter(condition)[:limit])
+
+            self.stdout.write(
+                f'{query:<28}{self.time_query(indexed, repeat):>12.1f}'
+                f'{self.time_query(icontains, repeat):>16.1f}')
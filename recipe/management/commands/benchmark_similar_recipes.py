@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from recipe.similarity import DEFAULT_CHUNK_SIZE, DEFAULT_TOP_K, top_k_neighbours
+
+
+class Command(BaseCommand):
+    help = ('Time the similar-recipes computation on synthetic likes of '
+            'increasing size. Nothing is read from or written to the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--likes', default='10000,100000,1000000',
+                            help='Comma separated numbers of likes to benchmark.')
+        parser.add_argument('--users-per-like', type=float, default=0.1)
+        parser.add_argument('--recipes-per-like', type=float, default=0.02)
+        parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def synthetic_likes(self, rng, total, n_users, n_recipes):
+        # Popularity of recipes follows a power law, as real likes do
+        recipes = (rng.zipf(1.5, total) - 1) % n_recipes
+        users = rng.integers(0, n_users, total)
+        pairs = np.unique(users * n_recipes + recipes)
+        return pairs // n_recipes, pairs % n_recipes
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        self.stdout.write(f'{"likes":>10}{"users":>10}{"recipes":>10}'
+                          f'{"neighbours":>12}{"seconds":>10}')
+        for total in [int(value) for value in options['likes'].split(',')]:
+            n_users = max(1, int(total * options['users_per_like']))
+            n_recipes = max(1, int(total * options['recipes_per_like']))
+            users, recipes = self.synthetic_likes(rng, total, n_users, n_recipes)
+
+            started = time.perf_counter()
+            neighbours = 0
+            for rows, _, _, _ in top_k_neighbours(
+                    users, recipes, n_users, n_recipes,
+                    options['top_k'], options['chunk_size']):
+                neighbours += len(rows)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{len(users):>10}{n_users:>10}{n_recipes:>10}'
+                              f'{neighbours:>12}{elapsed:>10.2f}')
@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from recipe.exporter import DEFAULT_CHUNK_SIZE, EXPORT_FORMATS, export_recipes
+
+
+class Command(BaseCommand):
+    help = 'Stream every recipe to a file (or stdout) as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help="Output file, or '-' for stdout.")
+        parser.add_argument('--output', choices=sorted(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunks = export_recipes(
+            options['output'], options['gzip'], options['chunk_size'])
+        if options['path'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        with open(options['path'], 'wb') as target:
+            for chunk in chunks:
+                target.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Exported recipes to {options['path']}"))
@@ -0,0 +1,33 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe.importer import DEFAULT_BATCH_SIZE, import_recipes
+
+
+class Command(BaseCommand):
+    help = 'Import recipes from an NDJSON file (one recipe per line).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, or '-' for stdin.")
+        parser.add_argument('--author', required=True,
+                            help='Email of the user the recipes are created for.')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            author = get_user_model().objects.get(email=options['author'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['author']}")
+
+        if options['path'] == '-':
+            report = import_recipes(sys.stdin, author, options['batch_size'])
+        else:
+            with open(options['path'], encoding='utf-8') as lines:
+                report = import_recipes(lines, author, options['batch_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} recipe(s), {report['failed']} failed."))
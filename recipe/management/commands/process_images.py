@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipe import images
+from recipe.models import Recipe
+from users.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Generate the variants of recipe pictures and avatars that have none yet.'
+
+    def handle(self, *args, **options):
+        processed = 0
+        recipes = Recipe.objects.filter(picture_variants={}).exclude(picture='').values_list(
+            'id', 'picture')
+        for recipe_id, name in recipes.iterator():
+            processed += images.process_recipe_picture(recipe_id, name)
+        profiles = Profile.objects.filter(avatar_variants={}).exclude(avatar='').values_list(
+            'id', 'avatar')
+        for profile_id, name in profiles.iterator():
+            processed += images.process_stored_image(
+                Profile, profile_id, 'avatar', name, images.AVATAR_WIDTHS)
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} image(s).'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from recipe.ingredients import index_recipe_ingredients
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Re-parse Recipe.ingredients and rebuild the ingredient postings.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipes = Recipe.objects.only('ingredients').order_by().iterator(
+            chunk_size=batch_size)
+        batch = []
+        total = 0
+        for recipe in recipes:
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                index_recipe_ingredients(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            index_recipe_ingredients(batch)
+            total += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Indexed ingredients of {total} recipe(s).'))
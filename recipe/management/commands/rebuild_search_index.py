@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from recipe.models import Recipe
+from recipe.search import FIELD_WEIGHTS, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text recipe search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fields = [field for field, _ in FIELD_WEIGHTS]
+        recipes = Recipe.objects.only(*fields).order_by().iterator(
+            chunk_size=batch_size)
+        documents = rebuild_index(recipes, batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {documents} recipe(s).'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipe.trending import rebuild_trending_scores
+
+
+class Command(BaseCommand):
+    help = 'Recompute every trending score from the stored likes.'
+
+    def handle(self, *args, **options):
+        processed = rebuild_trending_scores()
+        self.stdout.write(self.style.SUCCESS(f'Scored {processed} like(s).'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from recipe.models import Recipe, count_bookmarks_subquery, count_likes_subquery
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized like/bookmark counters and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of drifted recipes repaired per UPDATE statement.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many recipes have drifted.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drifted = Recipe.objects.annotate(
+            actual_likes=count_likes_subquery(),
+            actual_bookmarks=count_bookmarks_subquery(),
+        ).filter(
+            ~Q(number_of_likes=F('actual_likes')) |
+            ~Q(number_of_bookmarks=F('actual_bookmarks'))
+        ).order_by().values_list('id', flat=True)
+        drifted_ids = list(drifted)
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted_ids)} recipe(s) have drifted counters.')
+            return
+
+        for start in range(0, len(drifted_ids), batch_size):
+            batch = drifted_ids[start:start + batch_size]
+            with transaction.atomic():
+                Recipe.objects.filter(id__in=batch).update(
+                    number_of_likes=count_likes_subquery(),
+                    number_of_bookmarks=count_bookmarks_subquery(),
+                    updated_at=timezone.now(),
+                )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Repaired counters of {len(drifted_ids)} recipe(s).'))
@@ -0,0 +1,65 @@
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+
+class RecipeLikeManager(models.Manager):
+    """
+    Like / unlike as single statements that keep Recipe.number_of_likes in
+    sync. Both are idempotent and rely on the unique (user, recipe)
+    constraint, so concurrent requests cannot create duplicate likes.
+
+    The statements use INSERT ... ON CONFLICT DO NOTHING and RETURNING,
+    available on PostgreSQL and SQLite 3.35+.
+    """
+
+    @property
+    def recipe_model(self):
+        return self.model._meta.get_field('recipe').related_model
+
+    def update_counter(self, recipe_id, delta, now):
+        """
+        Apply `delta` to the recipe's like counter and return its new value.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.recipe_model._meta.db_table)
+        with connection.cursor() as cursor:
+            if delta:
+                cursor.execute(
+                    f'UPDATE {table} SET number_of_likes = number_of_likes + %s, '
+                    'updated_at = %s WHERE id = %s RETURNING number_of_likes',
+                    [delta, connection.ops.adapt_datetimefield_value(now), recipe_id])
+            else:
+                cursor.execute(
+                    f'SELECT number_of_likes FROM {table} WHERE id = %s', [recipe_id])
+            row = cursor.fetchone()
+        if row is None:
+            raise self.recipe_model.DoesNotExist
+        return row[0]
+
+    def like(self, user_id, recipe_id):
+        """
+        Returns (created, number_of_likes). Raises Recipe.DoesNotExist.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, recipe_id, created) '
+                    'VALUES (%s, %s, %s) '
+                    'ON CONFLICT (user_id, recipe_id) DO NOTHING RETURNING id',
+                    [user_id, recipe_id, connection.ops.adapt_datetimefield_value(now)])
+                created = cursor.fetchone() is not None
+            # Foreign keys are checked at commit, so a missing recipe shows
+            # up as a counter update matching no row, which rolls back.
+            return created, self.update_counter(recipe_id, int(created), now)
+
+    def unlike(self, user_id, recipe_id):
+        """
+        Returns (deleted, number_of_likes). Raises Recipe.DoesNotExist.
+        """
+        now = timezone.now()
+        with transaction.atomic(using=self.db):
+            deleted, _ = self.filter(user_id=user_id, recipe_id=recipe_id).delete()
+            return bool(deleted), self.update_counter(recipe_id, -deleted, now)
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, **filters):
+    rows = model.objects.filter(**filters).order_by()
+    return Coalesce(Subquery(
+        rows.values('recipe').annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()), 0)
+
+
+def populate_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeLike = apps.get_model('recipe', 'RecipeLike')
+    Profile = apps.get_model('users', 'Profile')
+    Recipe.objects.update(
+        number_of_likes=count_subquery(RecipeLike, recipe=OuterRef('pk')),
+        number_of_bookmarks=count_subquery(
+            Profile.bookmarks.through, recipe=OuterRef('pk')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0003_recipelike'),
+        ('users', '0010_alter_profile_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='number_of_bookmarks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='number_of_likes',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
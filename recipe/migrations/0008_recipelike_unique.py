@@ -0,0 +1,42 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:17
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    """
+    Keep the oldest like of every (user, recipe) pair and recount the
+    recipes that had duplicates.
+    """
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeLike = apps.get_model('recipe', 'RecipeLike')
+    duplicates = (RecipeLike.objects.values('user', 'recipe')
+                  .annotate(keep=Min('id'), total=Count('id'))
+                  .filter(total__gt=1).order_by())
+    recipe_ids = set()
+    for row in list(duplicates):
+        RecipeLike.objects.filter(
+            user=row['user'], recipe=row['recipe']).exclude(id=row['keep']).delete()
+        recipe_ids.add(row['recipe'])
+    if recipe_ids:
+        likes = RecipeLike.objects.filter(recipe=OuterRef('pk')).order_by()
+        Recipe.objects.filter(id__in=recipe_ids).update(number_of_likes=Coalesce(
+            Subquery(likes.values('recipe').annotate(total=Count('pk')).values('total'),
+                     output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0007_recipe_ingredient_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='recipelike',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_recipe_like'),
+        ),
+    ]
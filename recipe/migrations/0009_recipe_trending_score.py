@@ -0,0 +1,33 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_recipelike_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeTrendingScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending_score', serialize=False, to='recipe.recipe')),
+                ('score', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeTrendingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoch', models.DateTimeField()),
+                ('last_like_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipetrendingscore',
+            index=models.Index(fields=['-score'], name='recipe_trending_score_idx'),
+        ),
+    ]
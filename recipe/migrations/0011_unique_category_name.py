@@ -0,0 +1,36 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_categories(apps, schema_editor):
+    """
+    Move the recipes of duplicate categories to the oldest one of each
+    name and delete the others.
+    """
+    RecipeCategory = apps.get_model('recipe', 'RecipeCategory')
+    Recipe = apps.get_model('recipe', 'Recipe')
+    duplicates = (RecipeCategory.objects.values('name')
+                  .annotate(keep=Min('id'), total=Count('id'))
+                  .filter(total__gt=1).order_by())
+    for row in list(duplicates):
+        others = RecipeCategory.objects.filter(name=row['name']).exclude(id=row['keep'])
+        Recipe.objects.filter(category__in=others).update(category_id=row['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0010_similar_recipe'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_categories, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='recipecategory',
+            name='name',
+            field=models.CharField(max_length=100, unique=True, verbose_name='Category name'),
+        ),
+    ]
@@ -1,14 +1,21 @@
+import uuid
+
 from django.db import models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
 from django.core.exceptions import ObjectDoesNotExist
 
+from .managers import RecipeLikeManager
+from .storage import media_storage
+
 class RecipeCategory(models.Model):
     """
     Recipe categories
     """
-    name = models.CharField(_('Category name'), max_length=100)
+    name = models.CharField(_('Category name'), max_length=100, unique=True)
 
     class Meta:
         verbose_name = _('Recipe Category')
@@ -22,7 +29,8 @@ def get_default_recipe_category():
     """
     Returns a default recipe type.
     """
-    return RecipeCategory.objects.get_or_create(name='Others')[0]
+    from .categories import get_category
+    return get_category('Others')
 
 
 class Recipe(models.Model):
@@ -33,7 +41,9 @@ class Recipe(models.Model):
         settings.AUTH_USER_MODEL, related_name="recipes", on_delete=models.CASCADE)
     category = models.ForeignKey(
         RecipeCategory, related_name="recipe_list", on_delete=models.SET(get_default_recipe_category))
-    picture = models.ImageField(upload_to='uploads')
+    picture = models.ImageField(upload_to='uploads', storage=media_storage)
+    # Dimensions and resized copies of the picture, see recipe.images
+    picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     title = models.CharField(max_length=200)
     desc = models.CharField(_('Short description'), max_length=200)
     cook_time = models.TimeField()
@@ -41,18 +51,28 @@ class Recipe(models.Model):
     procedure = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, kept in sync by the like and bookmark write
+    # paths and repaired by the `recount_recipe_counters` command. Those
+    # updates move updated_at too, so it stays a valid Last-Modified.
+    number_of_likes = models.PositiveIntegerField(default=0)
+    number_of_bookmarks = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ('-created_at', )
+        indexes = [
+            # Backs keyset pagination over (created_at, id)
+            models.Index(fields=['-created_at', '-id'],
+                         name='recipe_created_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
     def get_total_number_of_likes(self):
-        return self.recipelike_set.count()
+        return self.number_of_likes
 
     def get_total_number_of_bookmarks(self):
-        return self.bookmarked_by.count()
+        return self.number_of_bookmarks
 
 
 class RecipeLike(models.Model):
@@ -64,9 +84,186 @@ class RecipeLike(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
 
+    objects = RecipeLikeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recipe'],
+                                    name='unique_recipe_like'),
+        ]
+
     def __str__(self):
         return self.user.username
 
+class RecipeSearchPosting(models.Model):
+    """
+    Inverted index entry: a term and its weighted frequency in one recipe
+    """
+    term = models.CharField(max_length=64)
+    recipe = models.ForeignKey(
+        Recipe, related_name='search_postings', on_delete=models.CASCADE)
+    frequency = models.PositiveIntegerField()
+    # Weighted length of the whole recipe, repeated on each posting so that
+    # ranking never has to join back to the recipe table.
+    length = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'recipe'],
+                                    name='unique_search_posting'),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class RecipeSearchStats(models.Model):
+    """
+    Corpus statistics used for BM25 ranking, kept in a single row
+    """
+    document_count = models.PositiveIntegerField(default=0)
+    total_length = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = _('Recipe search stats')
+
+
+class Ingredient(models.Model):
+    """
+    Normalized ingredient name parsed from Recipe.ingredients
+    """
+    name = models.CharField(_('Ingredient name'), max_length=100, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+class RecipeIngredient(models.Model):
+    """
+    Ingredient -> recipe posting, ordered by the unique (ingredient, recipe) index
+    """
+    ingredient = models.ForeignKey(
+        Ingredient, related_name='postings', on_delete=models.CASCADE)
+    recipe = models.ForeignKey(
+        Recipe, related_name='ingredient_postings', on_delete=models.CASCADE)
+    # Number of distinct ingredients in the recipe, repeated on each posting
+    # so that coverage can be computed from the posting lists alone.
+    recipe_ingredient_count = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ingredient', 'recipe'],
+                                    name='unique_recipe_ingredient'),
+        ]
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe_ingredient_count'],
+                         name='ingredient_count_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.ingredient)
+
+
+class RecipeTrendingScore(models.Model):
+    """
+    Time-decayed like score of a recipe, maintained by recipe.trending
+    """
+    recipe = models.OneToOneField(
+        Recipe, primary_key=True, related_name='trending_score', on_delete=models.CASCADE)
+    # Sum of 2 ** ((like.created - epoch) / half-life) over the recipe's
+    # likes. Scaling every score by the same decay keeps their order, so
+    # the stored values never need to be decayed one by one.
+    score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='recipe_trending_score_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.recipe_id)
+
+
+class RecipeTrendingState(models.Model):
+    """
+    Decay epoch of the trending scores and the last like folded into them,
+    kept in a single row
+    """
+    epoch = models.DateTimeField()
+    last_like_id = models.BigIntegerField(default=0)
+
+
+class SimilarRecipe(models.Model):
+    """
+    One of the top-K neighbours of a recipe by co-like cosine similarity,
+    rebuilt by recipe.similarity
+    """
+    recipe = models.ForeignKey(
+        Recipe, related_name='similar_recipes', on_delete=models.CASCADE)
+    similar_recipe = models.ForeignKey(
+        Recipe, related_name='+', on_delete=models.CASCADE)
+    score = models.FloatField()
+    # Number of users who liked both recipes
+    common_likes = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['recipe', 'similar_recipe'],
+                                    name='unique_similar_recipe'),
+        ]
+        indexes = [
+            models.Index(fields=['recipe', '-score'], name='similar_recipe_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} -> {self.similar_recipe_id}'
+
+
+class MediaBlob(models.Model):
+    """
+    A stored file, unique by content, with the number of image fields
+    referencing it. See recipe.storage
+    """
+    name = models.CharField(max_length=100, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Backs the garbage collector's scan for unreferenced blobs
+            models.Index(fields=['updated_at'], name='media_blob_unreferenced_idx',
+                         condition=models.Q(refcount__lte=0)),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload received in chunks, see recipe.uploads
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, related_name='upload_sessions', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    # Bytes received so far
+    offset = models.PositiveBigIntegerField(default=0)
+    # Storage name of the file once every byte has arrived
+    name = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def is_complete(self):
+        return bool(self.name)
+
+
 def get_recipe_details_by_user_id(userId):
     try:
         recipe = Recipe.objects.all().filter(author_id=userId).values('id', 'title')
@@ -76,7 +273,29 @@ def get_recipe_details_by_user_id(userId):
 
 def get_number_of_likes_using_recipe_id(recipeId):
     try:
-        number_of_likes = RecipeLike.objects.all().filter(recipe_id=recipeId).count()
+        number_of_likes = Recipe.objects.values_list(
+            'number_of_likes', flat=True).get(id=recipeId)
         return number_of_likes
     except ObjectDoesNotExist:
         return None
+
+
+def count_likes_subquery():
+    """
+    Subquery counting the RecipeLike rows of the outer recipe.
+    """
+    likes = RecipeLike.objects.filter(recipe=OuterRef('pk')).order_by()
+    return Coalesce(Subquery(
+        likes.values('recipe').annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()), 0)
+
+
+def count_bookmarks_subquery():
+    """
+    Subquery counting the bookmarks of the outer recipe.
+    """
+    bookmarks = Recipe.bookmarked_by.through.objects.filter(
+        recipe=OuterRef('pk')).order_by()
+    return Coalesce(Subquery(
+        bookmarks.values('recipe').annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()), 0)
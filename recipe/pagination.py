@@ -0,0 +1,161 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class RecipePagination(PageNumberPagination):
+    page_size = 2  # Number of items per page
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a descending `(timestamp, id)` ordering.
+
+    Every page is a single indexed range query, whatever its depth, and no
+    total count is computed. The cursors are opaque to the client.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 2
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # Both fields are ordered descending, the second one breaks ties.
+    ordering = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+        field, tiebreak = self.ordering
+
+        if position is not None:
+            value, key = position
+            if reverse:
+                seek = Q(**{f'{field}__gt': value}) | Q(**{field: value, f'{tiebreak}__gt': key})
+            else:
+                seek = Q(**{f'{field}__lt': value}) | Q(**{field: value, f'{tiebreak}__lt': key})
+            queryset = queryset.filter(seek)
+
+        if reverse:
+            queryset = queryset.order_by(field, tiebreak)
+        else:
+            queryset = queryset.order_by(f'-{field}', f'-{tiebreak}')
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_position(self, item):
+        field, tiebreak = self.ordering
+        return getattr(item, field), getattr(item, tiebreak)
+
+    def encode_cursor(self, item, reverse):
+        value, key = self.get_position(item)
+        payload = json.dumps({'v': value.isoformat(), 'k': key, 'r': int(reverse)})
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        url = remove_query_param(self.base_url, 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            value = parse_datetime(payload['v'])
+            key = int(payload['k'])
+            reverse = bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (value, key), reverse
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+
+class RecipeCursorPagination(KeysetPagination):
+    """
+    Opt-in keyset pagination for recipes, matching Recipe.Meta.ordering.
+    """
+    ordering = ('created_at', 'id')
+
+
+class BookmarkCursorPagination(KeysetPagination):
+    """
+    Keyset pagination over a profile's bookmarks, most recently bookmarked
+    first. The recipes are annotated with the bookmark's time and id.
+    """
+    ordering = ('bookmarked_at', 'bookmark_id')
@@ -0,0 +1,190 @@
+"""
+Full-text recipe search over a persistent inverted index.
+
+Each recipe is tokenized into `RecipeSearchPosting` rows (one per distinct
+term) and ranked with BM25 in a single aggregate query over the postings
+of the query terms, so searching never scans the recipe table.
+"""
+import math
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import (
+    Case, Count, ExpressionWrapper, F, FloatField, Max, Sum, Value, When)
+from django.db.models.functions import Cast
+
+from .models import RecipeSearchPosting, RecipeSearchStats
+
+# Title and description matches count more than body matches
+FIELD_WEIGHTS = (
+    ('title', 3),
+    ('desc', 2),
+    ('ingredients', 1),
+    ('procedure', 1),
+)
+MAX_TERM_LENGTH = 64
+STOP_WORDS = frozenset((
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in',
+    'into', 'is', 'it', 'of', 'on', 'or', 'the', 'then', 'to', 'until',
+    'with',
+))
+TOKEN_RE = re.compile(r'[^\W_]+')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """
+    Split text into lowercase index terms.
+    """
+    return [
+        token[:MAX_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+def get_document_terms(recipe):
+    """
+    Returns the weighted term frequencies and weighted length of a recipe.
+    """
+    frequencies = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        for term in tokenize(getattr(recipe, field) or ''):
+            frequencies[term] += weight
+    return frequencies, sum(frequencies.values())
+
+
+def update_stats(documents, length):
+    """
+    Apply a delta to the corpus statistics row.
+    """
+    if not documents and not length:
+        return
+    updated = RecipeSearchStats.objects.filter(pk=1).update(
+        document_count=F('document_count') + documents,
+        total_length=F('total_length') + length)
+    if not updated:
+        RecipeSearchStats.objects.create(
+            pk=1, document_count=max(documents, 0), total_length=max(length, 0))
+
+
+def index_recipes(recipes, batch_size=1000):
+    """
+    (Re)build the postings of the given recipes.
+
+    Returns the number of indexed documents and their total length.
+    """
+    recipes = list(recipes)
+    ids = [recipe.pk for recipe in recipes]
+    postings = []
+    documents = length = 0
+    for recipe in recipes:
+        frequencies, recipe_length = get_document_terms(recipe)
+        if not recipe_length:
+            continue
+        documents += 1
+        length += recipe_length
+        postings += [
+            RecipeSearchPosting(term=term, recipe_id=recipe.pk,
+                                frequency=frequency, length=recipe_length)
+            for term, frequency in frequencies.items()
+        ]
+
+    with transaction.atomic():
+        # Replace old postings and move the corpus stats by the difference
+        old_lengths = get_indexed_lengths(ids)
+        if old_lengths:
+            RecipeSearchPosting.objects.filter(recipe_id__in=ids).delete()
+        RecipeSearchPosting.objects.bulk_create(postings, batch_size=batch_size)
+        update_stats(documents - len(old_lengths),
+                     length - sum(old_lengths.values()))
+    return documents, length
+
+
+def index_recipe(recipe):
+    """
+    (Re)build the postings of a single recipe.
+    """
+    return index_recipes([recipe])
+
+
+def unindex_recipe(recipe_id):
+    """
+    Remove a recipe from the index.
+    """
+    with transaction.atomic():
+        old_lengths = get_indexed_lengths([recipe_id])
+        if old_lengths:
+            RecipeSearchPosting.objects.filter(recipe_id=recipe_id).delete()
+            update_stats(-1, -old_lengths[recipe_id])
+
+
+def get_indexed_lengths(recipe_ids):
+    """
+    Returns {recipe_id: indexed length} for the recipes already indexed.
+    """
+    return dict(
+        RecipeSearchPosting.objects.filter(recipe_id__in=recipe_ids)
+        .values('recipe_id').annotate(indexed_length=Max('length'))
+        .values_list('recipe_id', 'indexed_length'))
+
+
+def search_recipes(query):
+    """
+    Returns a `(recipe_id, score)` values queryset ranked by BM25.
+    """
+    terms = set(tokenize(query))
+    postings = RecipeSearchPosting.objects.filter(term__in=terms)
+    stats = RecipeSearchStats.objects.filter(pk=1).first()
+    if not terms or stats is None or not stats.document_count:
+        return postings.none().values('recipe_id')
+
+    document_count = stats.document_count
+    average_length = stats.total_length / document_count
+    document_frequencies = dict(
+        postings.values('term').annotate(df=Count('id')).values_list('term', 'df'))
+    if not document_frequencies:
+        return postings.none().values('recipe_id')
+
+    idf = Case(*[
+        When(term=term, then=Value(math.log(
+            1 + (document_count - df + 0.5) / (df + 0.5))))
+        for term, df in document_frequencies.items()
+    ], output_field=FloatField())
+    frequency = Cast('frequency', FloatField())
+    length = Cast('length', FloatField())
+    score = ExpressionWrapper(
+        idf * frequency * (K1 + 1) /
+        (frequency + K1 * (1 - B + B * length / average_length)),
+        output_field=FloatField())
+
+    return (
+        postings.values('recipe_id')
+        .annotate(score=Sum(score))
+        .order_by('-score', '-recipe_id')
+    )
+
+
+def rebuild_index(recipes, batch_size=1000):
+    """
+    Drop the whole index and rebuild it from the given recipe iterable.
+
+    Returns the number of indexed documents.
+    """
+    with transaction.atomic():
+        RecipeSearchPosting.objects.all().delete()
+        RecipeSearchStats.objects.update_or_create(
+            pk=1, defaults={'document_count': 0, 'total_length': 0})
+        batch = []
+        documents = 0
+        for recipe in recipes:
+            batch.append(recipe)
+            if len(batch) >= batch_size:
+                documents += index_recipes(batch)[0]
+                batch = []
+        if batch:
+            documents += index_recipes(batch)[0]
+    return documents
@@ -1,59 +1,307 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files import File
+from django.core.validators import validate_image_file_extension
+from django.db import models, transaction
+from django.utils.text import get_valid_filename
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+from .categories import get_category
+from .images import get_srcset
+from .like_buffer import get_user_states
+from .models import Recipe, RecipeCategory, RecipeLike, UploadSession
+
+# Per-user fields, left out of shared caches and added per request
+USER_FLAG_FIELDS = ('liked_by_me', 'bookmarked_by_me')
+
+
+def get_sparse_field_names(field_names, query_params):
+    """
+    Apply the `?fields=` / `?omit=` query parameters to a list of field names.
+    """
+    names = list(field_names)
+    if query_params.get('fields'):
+        selected = {name.strip() for name in query_params['fields'].split(',')}
+        names = [name for name in names if name in selected]
+    if query_params.get('omit'):
+        omitted = {name.strip() for name in query_params['omit'].split(',')}
+        names = [name for name in names if name not in omitted]
+    return names
+
+
+def get_model_columns(serializer, prefix=''):
+    """
+    Returns the model field paths a serializer reads, for use with `.only()`.
+    """
+    columns = set()
+    for field in serializer.fields.values():
+        if field.source == '*' or field.write_only:
+            continue
+        parts = field.source.split('.')
+        for end in range(1, len(parts) + 1):
+            columns.add(prefix + '__'.join(parts[:end]))
+        if isinstance(field, serializers.BaseSerializer):
+            columns |= get_model_columns(field, prefix + '__'.join(parts) + '__')
+    return columns
+
+
+# Columns read outside the serializer: paging, validators and cache scopes
+LIST_COLUMNS = ('created_at', 'updated_at', 'category__name', 'author__username')
+
+
+def prune_queryset(queryset, serializer, extra_columns=()):
+    """
+    Restrict a queryset to the columns and joins the serializer needs.
+    """
+    columns = get_model_columns(serializer) | set(extra_columns)
+    relations = {column.rsplit('__', 1)[0] for column in columns if '__' in column}
+    return queryset.select_related(None).select_related(*relations).only(*columns)
+
 
-from .models import Recipe, RecipeCategory, RecipeLike
+def get_user_flags(user, recipe_ids):
+    """
+    Returns the ids of the given recipes the user liked and bookmarked, with
+    one query each.
+    """
+    recipe_ids = list(recipe_ids)
+    flags = {'ids': set(recipe_ids), 'liked': set(), 'bookmarked': set()}
+    if user is None or not user.is_authenticated or not recipe_ids:
+        return flags
+    flags['liked'] = set(RecipeLike.objects.filter(
+        user=user, recipe_id__in=recipe_ids).values_list('recipe_id', flat=True))
+    for recipe_id, liked in get_user_states(user.pk, recipe_ids).items():
+        if liked:
+            flags['liked'].add(recipe_id)
+        else:
+            flags['liked'].discard(recipe_id)
+    flags['bookmarked'] = set(Recipe.bookmarked_by.through.objects.filter(
+        profile__user=user, recipe_id__in=recipe_ids).values_list('recipe_id', flat=True))
+    return flags
+
+
+def add_user_flags(items, recipe_ids, request):
+    """
+    Set the per-user fields of serialized recipes, in place. `recipe_ids`
+    matches `items` by position, as sparse fieldsets may omit the ids.
+    """
+    names = get_sparse_field_names(USER_FLAG_FIELDS, request.query_params)
+    if not names:
+        return items
+    flags = get_user_flags(request.user, recipe_ids)
+    for item, recipe_id in zip(items, recipe_ids):
+        if 'liked_by_me' in names:
+            item['liked_by_me'] = recipe_id in flags['liked']
+        if 'bookmarked_by_me' in names:
+            item['bookmarked_by_me'] = recipe_id in flags['bookmarked']
+    return items
+
+
+def strip_user_flags(items):
+    """
+    Copies of serialized recipes without the per-user fields.
+    """
+    return [{key: value for key, value in item.items() if key not in USER_FLAG_FIELDS}
+            for item in items]
+
+
+class SparseFieldsetsMixin:
+    """
+    Lets clients prune the output with `?fields=a,b` or `?omit=a,b`.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return fields
+        names = get_sparse_field_names(fields, request.query_params)
+        return OrderedDict((name, fields[name]) for name in names)
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Dimensions and srcset strings of a processed image, {} until then.
+    """
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return get_srcset(value, request.build_absolute_uri if request else None)
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    complete = serializers.BooleanField(source='is_complete', read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'size', 'offset', 'complete')
+        read_only_fields = ('offset',)
+
+    def validate_filename(self, value):
+        validate_image_file_extension(File(None, name=value))
+        return get_valid_filename(value)
+
+    def validate(self, data):
+        user = self.context['request'].user
+        if UploadSession.objects.filter(user=user).count() >= settings.UPLOAD_MAX_SESSIONS:
+            raise serializers.ValidationError(
+                f'At most {settings.UPLOAD_MAX_SESSIONS} uploads can be open at once. '
+                'Use or let the others expire first.')
+        return data
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f'Ensure this value is between 1 and {settings.UPLOAD_MAX_SIZE}.')
+        return value
+
+
+class UploadSessionField(serializers.PrimaryKeyRelatedField):
+    """
+    A completed upload session of the current user.
+    """
+    def get_queryset(self):
+        request = self.context.get('request')
+        if request is None:
+            return UploadSession.objects.none()
+        return UploadSession.objects.filter(user=request.user).exclude(name='')
+
+
+class UploadedImageMixin:
+    """
+    Accepts `upload`, the id of a completed upload session, in place of the
+    multipart image field named by `upload_field`. The session's file is
+    handed over to the saved row and the session is deleted with it.
+    """
+    upload_field = None
+
+    def validate(self, data):
+        session = data.get('upload')
+        if session is not None:
+            data[self.upload_field] = session.name
+        elif self.instance is None and not data.get(self.upload_field) \
+                and not self.Meta.model._meta.get_field(self.upload_field).blank:
+            raise serializers.ValidationError({self.upload_field: ['No file was submitted.']})
+        return super().validate(data)
+
+    def save(self, **kwargs):
+        session = self.validated_data.pop('upload', None)
+        with transaction.atomic():
+            # Locked, so neither expiry nor another claim can release the
+            # file before this row takes it over
+            if session is not None and not UploadSession.objects.select_for_update().filter(
+                    pk=session.pk).exists():
+                raise serializers.ValidationError(
+                    {'upload': ['This upload was already used or has expired.']})
+            instance = super().save(**kwargs)
+            if session is not None:
+                session.delete()
+        return instance
 
 
 class RecipeCategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeCategory
         fields = ('id', 'name')
+        # Recipes refer to categories by name, existing ones included
+        extra_kwargs = {'name': {'validators': []}}
+
 
+class RecipeCategoryCountSerializer(serializers.ModelSerializer):
+    number_of_recipes = serializers.IntegerField(read_only=True)
 
-class RecipeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RecipeCategory
+        fields = ('id', 'name', 'number_of_recipes')
+
+
+class RecipeFlagsListSerializer(serializers.ListSerializer):
+    """
+    Computes the current user's flags for a whole page at once instead of
+    per recipe.
+    """
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        request = self.context.get('request')
+        if request is not None and set(USER_FLAG_FIELDS) & set(self.child.fields):
+            self.context['user_flags'] = get_user_flags(
+                request.user, [item.pk for item in items])
+        return super().to_representation(items)
+
+
+class RecipeSerializer(UploadedImageMixin, SparseFieldsetsMixin, serializers.ModelSerializer):
     author = serializers.PrimaryKeyRelatedField(read_only=True)
-    username = serializers.SerializerMethodField()
-    category_name = serializers.SerializerMethodField()
+    username = serializers.CharField(source='author.username', read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True)
     category = RecipeCategorySerializer()
-    total_number_of_likes = serializers.SerializerMethodField()
-    total_number_of_bookmarks = serializers.SerializerMethodField()
+    total_number_of_likes = serializers.IntegerField(
+        source='number_of_likes', read_only=True)
+    total_number_of_bookmarks = serializers.IntegerField(
+        source='number_of_bookmarks', read_only=True)
+    picture_variants = ImageVariantsField()
+    upload = UploadSessionField(write_only=True, required=False)
+    liked_by_me = serializers.SerializerMethodField()
+    bookmarked_by_me = serializers.SerializerMethodField()
+    upload_field = 'picture'
 
     class Meta:
         model = Recipe
-        fields = ('id', 'category', 'category_name', 'picture', 'title', 'desc',
-                  'cook_time', 'ingredients', 'procedure', 'author', 'username',
-                  'total_number_of_likes', 'total_number_of_bookmarks')
-
-    def get_username(self, obj):
-        return obj.author.username
+        fields = ('id', 'category', 'category_name', 'picture', 'picture_variants',
+                  'title', 'desc', 'cook_time', 'ingredients', 'procedure', 'author',
+                  'username', 'total_number_of_likes', 'total_number_of_bookmarks',
+                  'liked_by_me', 'bookmarked_by_me', 'upload')
+        extra_kwargs = {'picture': {'required': False}}
+        list_serializer_class = RecipeFlagsListSerializer
 
-    def get_category_name(self, obj):
-        return obj.category.name
+    def get_user_flags(self, obj):
+        flags = self.context.get('user_flags')
+        if flags is None or obj.pk not in flags['ids']:
+            # Serialized on its own rather than through the list serializer
+            request = self.context.get('request')
+            flags = get_user_flags(request.user if request else None, [obj.pk])
+            self.context['user_flags'] = flags
+        return flags
 
-    def get_total_number_of_likes(self, obj):
-        return obj.get_total_number_of_likes()
+    def get_liked_by_me(self, obj):
+        return obj.pk in self.get_user_flags(obj)['liked']
 
-    def get_total_number_of_bookmarks(self, obj):
-        return obj.get_total_number_of_bookmarks()
+    def get_bookmarked_by_me(self, obj):
+        return obj.pk in self.get_user_flags(obj)['bookmarked']
 
     def create(self, validated_data):
         category = validated_data.pop('category')
-        category_instance, created = RecipeCategory.objects.get_or_create(
-            **category)
         recipe_instance = Recipe.objects.create(
-            **validated_data, category=category_instance)
+            **validated_data, category=get_category(category['name']))
         return recipe_instance
 
     def update(self, instance, validated_data):
         if 'category' in validated_data:
-            nested_serializer = self.fields['category']
-            nested_instance = instance.category
-            nested_data = validated_data.pop('category')
-
-            nested_serializer.update(nested_instance, nested_data)
+            # Move the recipe to the named category rather than renaming
+            # a category other recipes share
+            instance.category = get_category(validated_data.pop('category')['name'])
 
         return super(RecipeSerializer, self).update(instance, validated_data)
 
 
+class RecipeListSerializer(RecipeSerializer):
+    """
+    Compact recipe card for list pages, without the unbounded text columns
+    """
+    class Meta(RecipeSerializer.Meta):
+        fields = ('id', 'category', 'picture', 'picture_variants', 'title', 'desc',
+                  'cook_time', 'author', 'username', 'total_number_of_likes',
+                  'total_number_of_bookmarks', 'liked_by_me', 'bookmarked_by_me')
+
+
+class RecipeListCacheStatsSerializer(serializers.Serializer):
+    """
+    Hit/miss counters of the recipe list cache
+    """
+    hits = serializers.IntegerField()
+    misses = serializers.IntegerField()
+    hit_ratio = serializers.FloatField(allow_null=True)
+
+
 class RecipeLikeSerializer(serializers.ModelSerializer):
     user = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -0,0 +1,97 @@
+from collections import Counter
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .cache import (
+    bump_generations, category_scope, delete_recipe_details, get_recipe_scopes)
+from .ingredients import index_recipe_ingredients
+from .categories import categories, invalidate_categories, invalidate_category_counts
+from .images import get_image_files
+from .models import Recipe, RecipeCategory
+from .search import index_recipe, unindex_recipe
+from .storage import delete_on_commit
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_recipe(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_ingredient_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_recipe_ingredients([instance])
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_recipe(instance.pk)
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        previous = Recipe.objects.filter(pk=instance.pk).values_list(
+            'category_id', 'category__name', 'picture', 'picture_variants').first()
+        if previous:
+            instance._previous_category_id = previous[0]
+            instance._previous_category_name = previous[1]
+            instance._previous_files = get_image_files(previous[2], previous[3])
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_pictures(sender, instance, raw=False, **kwargs):
+    previous_files = getattr(instance, '_previous_files', None)
+    if previous_files and not raw:
+        replaced = Counter(previous_files) - Counter(
+            get_image_files(instance.picture.name, instance.picture_variants))
+        delete_on_commit(replaced.elements(), Recipe, 'picture')
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_pictures(sender, instance, **kwargs):
+    delete_on_commit(
+        get_image_files(instance.picture.name, instance.picture_variants), Recipe, 'picture')
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_cached_lists_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = get_recipe_scopes(
+        instance.category.name, instance.author.username, membership=created)
+    previous_category_name = getattr(instance, '_previous_category_name', None)
+    if previous_category_name:
+        scopes.add(category_scope(previous_category_name))
+    transaction.on_commit(lambda: bump_generations(scopes))
+    transaction.on_commit(lambda: delete_recipe_details([instance.pk]))
+    if created or previous_category_name != instance.category.name:
+        category_ids = {instance.category_id, getattr(instance, '_previous_category_id', None)}
+        category_ids.discard(None)
+        transaction.on_commit(lambda: invalidate_category_counts(category_ids))
+
+
+@receiver(pre_delete, sender=Recipe)
+def invalidate_cached_lists_on_delete(sender, instance, **kwargs):
+    scopes = get_recipe_scopes(
+        instance.category.name, instance.author.username, membership=True)
+    pk = instance.pk
+    category_id = instance.category_id
+    transaction.on_commit(lambda: bump_generations(scopes))
+    transaction.on_commit(lambda: delete_recipe_details([pk]))
+    transaction.on_commit(lambda: invalidate_category_counts([category_id]))
+
+
+@receiver(post_save, sender=RecipeCategory)
+@receiver(post_delete, sender=RecipeCategory)
+def invalidate_cached_categories(sender, **kwargs):
+    transaction.on_commit(invalidate_categories)
+
+
+@receiver(post_delete, sender=RecipeCategory)
+def invalidate_moved_recipe_counts(sender, **kwargs):
+    # Its recipes moved to the default category with a plain UPDATE
+    transaction.on_commit(lambda: invalidate_category_counts(categories.get().values()))
@@ -0,0 +1,107 @@
+"""
+"Similar recipes" from co-likes.
+
+The likes form a binary user x recipe matrix X. The co-like counts of all
+recipe pairs are C = X^T X, and the cosine similarity of two recipes is
+C[i, j] / sqrt(n_i * n_j), where n_i is the number of likes of recipe i.
+C is computed for a chunk of recipes at a time and only the top K
+neighbours of each are kept, so memory is bounded by the chunk size
+rather than by the number of recipe pairs.
+"""
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+
+from .models import Recipe, RecipeLike, SimilarRecipe
+
+DEFAULT_TOP_K = 20
+# Recipes per block of X^T X
+DEFAULT_CHUNK_SIZE = 2000
+# Likes read from the database at a time
+LOAD_CHUNK_SIZE = 100000
+INSERT_BATCH_SIZE = 5000
+
+
+def load_likes(chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Returns the (user_ids, recipe_ids) arrays of every like.
+    """
+    rows = RecipeLike.objects.order_by().values_list('user_id', 'recipe_id').iterator(
+        chunk_size=chunk_size)
+    users, recipes = [], []
+    batch = list(islice(rows, chunk_size))
+    while batch:
+        pairs = np.array(batch, dtype=np.int64)
+        users.append(pairs[:, 0])
+        recipes.append(pairs[:, 1])
+        batch = list(islice(rows, chunk_size))
+    if not users:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(users), np.concatenate(recipes)
+
+
+def top_k_neighbours(user_index, recipe_index, n_users, n_recipes,
+                     k=DEFAULT_TOP_K, chunk_size=DEFAULT_CHUNK_SIZE, min_common=1):
+    """
+    Yields (recipes, neighbours, scores, common_likes) arrays, in index
+    space, for consecutive chunks of recipes. Each recipe keeps its `k`
+    most similar neighbours sharing at least `min_common` likes.
+    """
+    likes = sparse.csr_matrix(
+        (np.ones(len(user_index), dtype=np.int32), (user_index, recipe_index)),
+        shape=(n_users, n_recipes))
+    likes.data[:] = 1  # duplicate pairs were summed
+    liked_by = likes.T.tocsr()
+    norms = np.sqrt(np.diff(liked_by.indptr).astype(np.float64))
+
+    for start in range(0, n_recipes, chunk_size):
+        common = (liked_by[start:start + chunk_size] @ likes).tocoo()
+        rows = common.row.astype(np.int64) + start
+        columns = common.col.astype(np.int64)
+        counts = common.data
+        keep = (rows != columns) & (counts >= min_common)
+        rows, columns, counts = rows[keep], columns[keep], counts[keep]
+        scores = counts / (norms[rows] * norms[columns])
+
+        # Sort by recipe, best neighbours first, and keep the first k of
+        # every recipe's run.
+        order = np.lexsort((-scores, rows))
+        rows, columns, counts, scores = rows[order], columns[order], counts[order], scores[order]
+        run_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        run_lengths = np.diff(np.r_[run_starts, len(rows)])
+        rank = np.arange(len(rows)) - np.repeat(run_starts, run_lengths)
+        top = rank < k
+        yield rows[top], columns[top], scores[top], counts[top]
+
+
+def build_similar_recipes(k=DEFAULT_TOP_K, chunk_size=DEFAULT_CHUNK_SIZE, min_common=1):
+    """
+    Rebuild the SimilarRecipe table from the likes. Returns the number of
+    rows written.
+    """
+    user_ids, recipe_ids = load_likes()
+    recipe_keys, recipe_index = np.unique(recipe_ids, return_inverse=True)
+    user_keys, user_index = np.unique(user_ids, return_inverse=True)
+    # Recipes deleted since the likes were read are left out
+    existing = np.isin(recipe_keys, np.fromiter(
+        Recipe.objects.values_list('id', flat=True).iterator(), dtype=np.int64))
+
+    written = 0
+    with transaction.atomic():
+        SimilarRecipe.objects.all().delete()
+        chunks = top_k_neighbours(
+            user_index, recipe_index, len(user_keys), len(recipe_keys),
+            k, chunk_size, min_common)
+        for rows, columns, scores, counts in chunks:
+            keep = existing[rows] & existing[columns]
+            SimilarRecipe.objects.bulk_create([
+                SimilarRecipe(recipe_id=recipe_id, similar_recipe_id=similar_id,
+                              score=score, common_likes=count)
+                for recipe_id, similar_id, score, count in zip(
+                    recipe_keys[rows[keep]].tolist(), recipe_keys[columns[keep]].tolist(),
+                    scores[keep].tolist(), counts[keep].tolist())
+            ], batch_size=INSERT_BATCH_SIZE)
+            written += int(keep.sum())
+    return written
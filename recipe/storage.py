@@ -0,0 +1,172 @@
+"""
+Content-addressed media storage.
+
+Files are stored once under the SHA-256 digest of their bytes, as
+`blobs/ab/cd/abcd....jpg`, whatever name they were uploaded with, and a
+MediaBlob row counts the image fields referencing each one. Saving bytes
+that are already stored only bumps that count, so a re-uploaded stock
+photo costs no write. `delete()` releases a reference, and blobs left
+unreferenced for MEDIA_BLOB_GC_GRACE seconds are removed in batches by
+the collect_media_blobs task.
+
+A save creates the blob row if needed and locks it before counting the
+reference and checking for and writing the file. The collector only
+deletes the files of rows it holds locked, and skips rows locked by
+others. A save that finds its row deleted by the collector, after
+waiting for its lock, starts over with a new row. So a blob cannot be
+collected between being counted and being written.
+"""
+import hashlib
+import os
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs/'
+GC_BATCH_SIZE = 500
+
+
+def get_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_blob_name(digest, name):
+    extension = os.path.splitext(name)[1].lower()
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+
+def add_references(names, sign):
+    """
+    Add (sign=1) or release (sign=-1) one reference per occurrence of a
+    blob name, with one UPDATE per distinct count. Returns the number of
+    rows updated.
+    """
+    from .models import MediaBlob
+
+    by_count = defaultdict(list)
+    for name, count in Counter(names).items():
+        if name.startswith(BLOB_PREFIX):
+            by_count[count].append(name)
+    updated = 0
+    for count, group in by_count.items():
+        updated += MediaBlob.objects.filter(name__in=group).update(
+            refcount=F('refcount') + sign * count, updated_at=timezone.now())
+    return updated
+
+
+def retain(names):
+    """
+    Count new references to already stored files, such as the picture
+    paths of imported recipes.
+    """
+    return add_references(names, 1)
+
+
+def release(names):
+    return add_references(names, -1)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The stored name is derived from the content in _save
+        return name
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+
+        # Hashed in one read and written in a second only when new. A
+        # large upload is already on disk and is moved, not copied.
+        blob_name = get_blob_name(get_digest(content), name)
+        while True:
+            with transaction.atomic():
+                MediaBlob.objects.bulk_create(
+                    [MediaBlob(name=blob_name, size=content.size)], ignore_conflicts=True)
+                # Waits for a collector holding the row. Finding the row
+                # gone, or counting nothing, means it was just collected.
+                locked = MediaBlob.objects.select_for_update().filter(name=blob_name).exists()
+                if locked and retain([blob_name]):
+                    if not self.exists(blob_name):
+                        super()._save(blob_name, content)
+                    return blob_name
+
+    def delete(self, name):
+        """
+        Release a reference to a blob. Any other name is left alone, see
+        `release_files`.
+        """
+        release([name])
+
+    def delete_many(self, names):
+        release([name for name in names if name])
+
+
+media_storage = ContentAddressedStorage()
+
+
+def delete_legacy_files(model, field_name, names):
+    """
+    Delete files saved before this storage was in use, which are not
+    counted. Only names under the field's upload_to, where the field saved
+    them, and no longer held by any row of `model` are deleted.
+    """
+    prefix = model._meta.get_field(field_name).upload_to.rstrip('/') + '/'
+    names = {name for name in names
+             if name.startswith(prefix) and not name.startswith(BLOB_PREFIX)}
+    if not names:
+        return
+    held = set(model.objects.filter(**{f'{field_name}__in': names}).values_list(
+        field_name, flat=True))
+    for name in names - held:
+        FileSystemStorage.delete(media_storage, name)
+
+
+def release_files(names, model, field_name):
+    """
+    Drop the references a row of `model` held through `field_name`: blobs
+    are released and files from before this storage deleted. `names` must
+    be read from the row itself, never taken from a client.
+    """
+    names = [name for name in names if name]
+    media_storage.delete_many(names)
+    delete_legacy_files(model, field_name, names)
+
+
+def delete_on_commit(names, model, field_name):
+    """
+    `release_files` once the transaction dropping the references commits.
+    """
+    names = list(names)
+    if names:
+        transaction.on_commit(lambda: release_files(names, model, field_name))
+
+
+def collect_media_blobs(batch_size=GC_BATCH_SIZE):
+    """
+    Delete the blobs unreferenced for longer than MEDIA_BLOB_GC_GRACE, a
+    batch per transaction. Returns the number of blobs deleted.
+    """
+    from .models import MediaBlob
+
+    cutoff = timezone.now() - timedelta(seconds=settings.MEDIA_BLOB_GC_GRACE)
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            names = list(MediaBlob.objects.select_for_update(skip_locked=True).filter(
+                refcount__lte=0, updated_at__lt=cutoff,
+            ).values_list('name', flat=True)[:batch_size])
+            for name in names:
+                FileSystemStorage.delete(media_storage, name)
+            MediaBlob.objects.filter(name__in=names).delete()
+        deleted += len(names)
+        if len(names) < batch_size:
+            return deleted
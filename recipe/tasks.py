@@ -0,0 +1,38 @@
+from celery import shared_task
+
+from recipe import images, like_buffer, similarity, storage, trending, uploads
+
+
+@shared_task(bind=True)
+def flush_like_buffer(self):
+    return like_buffer.flush()
+
+
+@shared_task(bind=True)
+def update_trending_scores(self):
+    return trending.update_trending_scores()
+
+
+@shared_task(bind=True)
+def rebuild_trending_scores(self):
+    return trending.rebuild_trending_scores()
+
+
+@shared_task(bind=True)
+def build_similar_recipes(self):
+    return similarity.build_similar_recipes()
+
+
+@shared_task(bind=True)
+def process_recipe_picture(self, recipe_id, name):
+    return images.process_recipe_picture(recipe_id, name)
+
+
+@shared_task(bind=True)
+def collect_media_blobs(self):
+    return storage.collect_media_blobs()
+
+
+@shared_task(bind=True)
+def expire_upload_sessions(self):
+    return uploads.expire_upload_sessions()
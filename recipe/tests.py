@@ -1,17 +1,42 @@
 from django.urls import reverse
 from rest_framework import status
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework.test import APIClient
 from PIL import Image
+import gzip
+import json
+import os
 import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 
+from config.celery import app as celery_app
+from config.settings.testing import FAKE_REDIS_CACHES
+from users.authentication import local_users
 from users.models import CustomUser
+from . import like_buffer, similarity, storage, trending
+from .categories import categories, get_category
+from .cache import get_detail_keys
+from .ingredients import parse_ingredients
+from .models import MediaBlob, Recipe, RecipeCategory, RecipeLike, UploadSession
 
+@override_settings(CACHES=FAKE_REDIS_CACHES, MEDIA_ROOT=tempfile.mkdtemp())
 class RecipeAPITestCases(TestCase):
     def setUp(self):
         # Initialize the API client
         self.client = APIClient()
+        cache.clear()
+        categories.clear()
+        local_users.clear()
+        # Run the tasks queued by the views in-process
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
         self.user = CustomUser.objects.create_user(
             username='testuser',
             email='testuser@example.com',
@@ -187,4 +212,775 @@ class RecipeAPITestCases(TestCase):
         self.client.post(f'/api/recipe/{recipe_id}/like/')
 
         recipe_unlike_response = self.client.delete(f'/api/recipe/{recipe_id}/like/')
-        self.assertEqual(recipe_unlike_response.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(recipe_unlike_response.status_code, status.HTTP_200_OK)
+
+    def test_like_updates_recipe_counter(self):
+        """Liking and unliking keeps Recipe.number_of_likes in sync"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+
+        self.client.post(f'/api/recipe/{recipe_id}/like/')
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_likes, 1)
+
+        self.client.delete(f'/api/recipe/{recipe_id}/like/')
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_likes, 0)
+
+    def test_like_is_idempotent(self):
+        """Repeated likes and unlikes succeed and return the like count"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        url = f'/api/recipe/{recipe_id}/like/'
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'total_number_of_likes': 1})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'total_number_of_likes': 1})
+        self.assertEqual(RecipeLike.objects.filter(recipe_id=recipe_id).count(), 1)
+
+        self.assertEqual(self.client.delete(url).data, {'total_number_of_likes': 0})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'total_number_of_likes': 0})
+
+        self.assertEqual(self.client.post('/api/recipe/999/like/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertFalse(RecipeLike.objects.filter(recipe_id=999).exists())
+
+    def test_bookmark_updates_recipe_counter(self):
+        """Adding and removing bookmarks keeps Recipe.number_of_bookmarks in sync"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        url = f'/api/user/profile/{self.user.id}/bookmarks/'
+
+        self.client.post(url, {'id': recipe_id}, format='json')
+        self.client.post(url, {'id': recipe_id}, format='json')
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_bookmarks, 1)
+
+        self.client.delete(url, {'id': recipe_id}, format='json')
+        self.client.delete(url, {'id': recipe_id}, format='json')
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_bookmarks, 0)
+
+    def test_deleting_user_updates_recipe_counters(self):
+        """A deleted user's likes and bookmarks are taken off the recipe counters"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        other_user = CustomUser.objects.create_user(
+            username='other', email='other@example.com', password='otherpass')
+        self.client.force_authenticate(other_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipe/{recipe_id}/like/')
+            self.client.post(f'/api/user/profile/{other_user.id}/bookmarks/',
+                             {'id': recipe_id}, format='json')
+        response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertEqual(response.data['total_number_of_likes'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other_user.delete()
+        recipe = Recipe.objects.get(id=recipe_id)
+        self.assertEqual((recipe.number_of_likes, recipe.number_of_bookmarks), (0, 0))
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertEqual((response.data['total_number_of_likes'],
+                          response.data['total_number_of_bookmarks']), (0, 0))
+
+    def test_recipe_list_query_count(self):
+        """Listing recipes does not issue per-row COUNT queries"""
+        access_token = self.login_functionality()
+        for _ in range(3):
+            self.create_recipe_functionality(access_token)
+        self.client.credentials()
+        with self.assertNumQueries(3):  # validators + page COUNT + page rows
+            response = self.client.get('/api/recipe/?page_size=3')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_recount_recipe_counters_command(self):
+        """The recount command repairs drifted counters"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        RecipeLike.objects.create(user=self.user, recipe_id=recipe_id)
+        Recipe.objects.filter(id=recipe_id).update(number_of_bookmarks=5)
+
+        call_command('recount_recipe_counters', stdout=StringIO())
+        recipe = Recipe.objects.get(id=recipe_id)
+        self.assertEqual(recipe.number_of_likes, 1)
+        self.assertEqual(recipe.number_of_bookmarks, 0)
+
+    def test_recipe_list_cursor_pagination(self):
+        """Keyset pagination walks the list without a total count"""
+        access_token = self.login_functionality()
+        created_ids = [self.create_recipe_functionality(access_token).data['id']
+                       for _ in range(5)]
+        self.client.credentials()
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipe/?pagination=cursor&page_size=2')
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+        seen = [recipe['id'] for recipe in response.data['results']]
+        next_url = response.data['next']
+        while next_url:
+            response = self.client.get(next_url)
+            seen += [recipe['id'] for recipe in response.data['results']]
+            previous_url, next_url = response.data['previous'], response.data['next']
+        self.assertEqual(seen, list(reversed(created_ids)))
+
+        previous_page = self.client.get(previous_url)
+        self.assertEqual([recipe['id'] for recipe in previous_page.data['results']],
+                         seen[2:4])
+
+    def test_recipe_list_invalid_cursor(self):
+        """A tampered cursor is rejected"""
+        response = self.client.get('/api/recipe/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_recipes(self):
+        """Search ranks matches and follows recipe updates and deletes"""
+        access_token = self.login_functionality()
+        first_id = self.create_recipe_functionality(access_token).data['id']
+        second_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.client.patch(f'/api/recipe/{second_id}/',
+                          {'title': 'Butter chicken'}, format='multipart')
+
+        response = self.client.get('/api/recipe/search/?q=butter')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [second_id, first_id])
+
+        response = self.client.get('/api/recipe/search/?q=chicken')
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [second_id])
+
+        self.client.delete(f'/api/recipe/{second_id}/')
+        response = self.client.get('/api/recipe/search/?q=chicken')
+        self.assertEqual(response.data['count'], 0)
+
+    def test_search_without_terms(self):
+        """An empty query returns no results"""
+        response = self.client.get('/api/recipe/search/?q=the')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+    def test_parse_ingredients(self):
+        """Free-text ingredient lists are normalized"""
+        self.assertEqual(
+            parse_ingredients('2 cups chopped Tomatoes, 3 eggs;\nsalt and pepper (optional)'),
+            {'tomato', 'egg', 'salt', 'pepper'})
+
+    def test_cook_with_ingredients(self):
+        """Recipes are ranked by coverage of the supplied ingredients"""
+        access_token = self.login_functionality()
+        first_id = self.create_recipe_functionality(access_token).data['id']
+        second_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.client.patch(f'/api/recipe/{second_id}/', {
+            'ingredients': '2 cups Flour, 3 eggs, milk and sugar'}, format='multipart')
+
+        response = self.client.get(
+            '/api/recipe/cook-with/?ingredients=flour,Sugar&max_missing=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [first_id])
+        self.assertEqual(response.data['results'][0]['missing_ingredients'], 1)
+
+        response = self.client.get(
+            '/api/recipe/cook-with/?ingredients=flour,sugar,eggs,milk')
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [second_id, first_id])
+
+        response = self.client.get('/api/recipe/cook-with/?ingredients=flour&max_missing=x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_recipe_list_cache(self):
+        """Anonymous lists are cached and invalidated by likes"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+
+        self.assertEqual(self.client.get('/api/recipe/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recipe/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipe/{recipe_id}/like/')
+        self.client.credentials()
+
+        response = self.client.get('/api/recipe/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['results'][0]['total_number_of_likes'], 1)
+
+    def test_recipe_list_cache_invalidation_is_scoped(self):
+        """A like only invalidates pages showing the recipe's category or author"""
+        access_token = self.login_functionality()
+        self.create_recipe_functionality(access_token)
+        other_user = CustomUser.objects.create_user(
+            username='other', email='other@example.com', password='otherpass')
+        other_recipe = Recipe.objects.create(
+            author=other_user, category=RecipeCategory.objects.create(name='Dinner'),
+            picture='uploads/other.jpg', title='Other', desc='Other',
+            cook_time='00:30:00', ingredients='Rice', procedure='Boil')
+        self.client.credentials()
+        lunch_url = '/api/recipe/?category__name=Lunch'
+        self.client.get(lunch_url)
+        self.client.get('/api/recipe/')
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipe/{other_recipe.id}/like/')
+        self.client.credentials()
+
+        self.assertEqual(self.client.get(lunch_url)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/recipe/')['X-Cache'], 'MISS')
+
+    def test_recipe_list_cache_stats(self):
+        """Cache hit/miss counters are exposed to admins"""
+        self.client.get('/api/recipe/')
+        self.client.get('/api/recipe/')
+        admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/recipe/cache/stats/')
+        self.assertEqual(response.data, {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    def test_recipe_detail_cache(self):
+        """Recipe details are cached and dropped when the recipe changes"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+        self.client.force_authenticate(self.user)
+
+        self.client.get(f'/api/recipe/{recipe_id}/')
+        with self.assertNumQueries(2):  # liked_by_me + bookmarked_by_me
+            response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertTrue(response.data['picture'].startswith('http://testserver/'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipe/{recipe_id}/', {'title': 'Renamed'},
+                              format='multipart')
+        response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertEqual(response.data['title'], 'Renamed')
+
+    def test_recipe_detail_serves_stale_copy_while_rebuilding(self):
+        """Only the lock holder rebuilds an expired detail entry"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+        self.client.force_authenticate(self.user)
+        self.client.get(f'/api/recipe/{recipe_id}/')
+
+        data_key, fresh_key, lock_key = get_detail_keys(recipe_id)
+        cache.delete(fresh_key)
+        cache.set(lock_key, 1)  # another worker is rebuilding
+        Recipe.objects.filter(id=recipe_id).update(title='Changed')
+        with self.assertNumQueries(2):  # liked_by_me + bookmarked_by_me
+            response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertEqual(response.data['title'], 'Test Recipe')
+
+        cache.delete(lock_key)
+        response = self.client.get(f'/api/recipe/{recipe_id}/')
+        self.assertEqual(response.data['title'], 'Changed')
+
+    def test_recipe_detail_caches_missing_recipes(self):
+        """A missing recipe is remembered briefly instead of making waiters poll"""
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/recipe/999/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recipe/999/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        # A waiter stops as soon as the lock holder is gone
+        data_key, fresh_key, lock_key = get_detail_keys(998)
+        cache.set(lock_key, 1, timeout=0.1)
+        started = time.monotonic()
+        self.assertEqual(self.client.get('/api/recipe/998/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_recipe_detail_conditional_get(self):
+        """Recipe details honour If-None-Match and If-Modified-Since"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+
+        response = self.client.get(f'/api/recipe/{recipe_id}/')
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        response = self.client.get(f'/api/recipe/{recipe_id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(f'/api/recipe/{recipe_id}/',
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipe/{recipe_id}/like/')
+        response = self.client.get(f'/api/recipe/{recipe_id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # On a cache miss the validators are checked before serializing
+        etag = response['ETag']
+        data_key = get_detail_keys(recipe_id)[0]
+        cache.delete(data_key)
+        response = self.client.get(f'/api/recipe/{recipe_id}/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIsNone(cache.get(data_key))
+
+    def test_recipe_list_conditional_get(self):
+        """Unchanged recipe lists answer 304 without fetching the page"""
+        access_token = self.login_functionality()
+        self.create_recipe_functionality(access_token)
+        self.client.force_authenticate(self.user)
+
+        etag = self.client.get('/api/recipe/')['ETag']
+        cache.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipe/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get('/api/recipe/?page_size=1', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_recipe_list_is_compact(self):
+        """Lists leave out the long text fields the detail view returns"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+
+        item = self.client.get('/api/recipe/').data['results'][0]
+        self.assertNotIn('ingredients', item)
+        self.assertNotIn('procedure', item)
+        self.assertEqual(item['username'], 'testuser')
+        self.client.force_authenticate(self.user)
+        self.assertIn('procedure', self.client.get(f'/api/recipe/{recipe_id}/').data)
+
+    def test_recipe_sparse_fieldsets(self):
+        """?fields= and ?omit= prune the returned fields"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+
+        response = self.client.get('/api/recipe/?fields=id,title')
+        self.assertEqual(response.data['results'], [{'id': recipe_id, 'title': 'Test Recipe'}])
+        item = self.client.get('/api/recipe/?omit=desc,category').data['results'][0]
+        self.assertNotIn('desc', item)
+        self.assertNotIn('category', item)
+        self.assertIn('title', item)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(f'/api/recipe/{recipe_id}/?fields=id,procedure')
+        self.assertEqual(response.data, {'id': recipe_id, 'procedure': 'Mix and bake'})
+
+    def test_import_recipes(self):
+        """Admins import NDJSON rows, which must name a stored blob or a finished upload"""
+        MediaBlob.objects.create(name='blobs/ab/cd/soup.jpg', size=1)
+        session = UploadSession.objects.create(
+            user=self.user, filename='salad.jpg', size=1, offset=1, name='blobs/ef/01/salad.jpg')
+        rows = [
+            {'title': 'Soup', 'desc': 'Warm', 'cook_time': '00:30:00',
+             'ingredients': 'Leek, Potato', 'procedure': 'Simmer',
+             'picture': 'blobs/ab/cd/soup.jpg', 'category': 'Dinner'},
+            {'title': 'Broken', 'category': 'Dinner'},
+            {'title': 'Salad', 'desc': 'Fresh', 'cook_time': '00:10:00',
+             'ingredients': 'Lettuce', 'procedure': 'Toss',
+             'upload': str(session.pk), 'category': 'Lunch'},
+            {'title': 'Stolen', 'desc': 'Not mine', 'cook_time': '00:10:00',
+             'ingredients': 'Lettuce', 'procedure': 'Toss',
+             'picture': 'avatar/someone.jpg', 'category': 'Lunch'},
+            {'title': 'Missing', 'desc': 'Gone', 'cook_time': '00:10:00',
+             'ingredients': 'Lettuce', 'procedure': 'Toss',
+             'picture': 'blobs/00/00/missing.jpg', 'category': 'Lunch'},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n'
+        self.client.force_authenticate(self.user)
+        response = self.client.post(
+            '/api/recipe/import/', data=body.encode(), content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass')
+        session.user = admin
+        session.save()
+        self.client.force_authenticate(admin)
+        response = self.client.post(
+            '/api/recipe/import/', data=body.encode(), content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], 4)
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 4, 5, 6])
+        self.assertIn('procedure', response.data['errors'][0]['errors'])
+        self.assertEqual(Recipe.objects.filter(author=admin).count(), 2)
+        self.assertEqual(Recipe.objects.get(title='Salad').picture.name, 'blobs/ef/01/salad.jpg')
+        self.assertEqual(Recipe.objects.get(title='Salad').category.name, 'Lunch')
+        self.assertEqual(MediaBlob.objects.get(name='blobs/ab/cd/soup.jpg').refcount, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(self.client.get('/api/recipe/search/?q=leek').data['count'], 1)
+
+    def test_export_recipes(self):
+        """Admins can stream every recipe as NDJSON or gzipped CSV"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials()
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipe/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = CustomUser.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpass')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/recipe/export/')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['id'], row['category'], row['username']) for row in rows],
+                         [(recipe_id, 'Lunch', 'testuser')])
+
+        response = self.client.get('/api/recipe/export/?output=csv&gzip=1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('id,title,desc,category'))
+
+        response = self.client.get('/api/recipe/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RECIPE_LIKE_BUFFER=True)
+    def test_like_buffer(self):
+        """Buffered likes are counted at once and written by the flush"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        url = f'/api/recipe/{recipe_id}/like/'
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'total_number_of_likes': 1})
+        self.assertFalse(RecipeLike.objects.exists())
+        self.assertEqual(self.client.get(f'/api/recipe/{recipe_id}/').data['total_number_of_likes'], 1)
+        self.client.credentials()
+        self.assertEqual(self.client.get('/api/recipe/').data['results'][0]['total_number_of_likes'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(like_buffer.flush(), 1)
+        self.assertTrue(RecipeLike.objects.filter(user=self.user, recipe_id=recipe_id).exists())
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_likes, 1)
+        self.assertEqual(self.client.get('/api/recipe/').data['results'][0]['total_number_of_likes'], 1)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(self.client.delete(url).data, {'total_number_of_likes': 0})
+        with self.captureOnCommitCallbacks(execute=True):
+            like_buffer.flush()
+        self.assertFalse(RecipeLike.objects.exists())
+        self.assertEqual(Recipe.objects.get(id=recipe_id).number_of_likes, 0)
+
+    @override_settings(RECIPE_LIKE_BUFFER=True)
+    def test_like_buffer_recovers_interrupted_flush(self):
+        """A flush completes the writes a crashed flush had taken over"""
+        access_token = self.login_functionality()
+        recipe_id = self.create_recipe_functionality(access_token).data['id']
+        client = like_buffer.get_client()
+
+        like_buffer.record_like(self.user.id, recipe_id)
+        # A flush that died after taking the pending writes over
+        like_buffer.take_pending(client, [recipe_id])
+        self.assertEqual(like_buffer.get_like_deltas([recipe_id]), {recipe_id: 1})
+        # A newer unlike must win over the interrupted like
+        like_buffer.record_like(self.user.id, recipe_id, liked=False)
+        self.assertEqual(like_buffer.get_like_deltas([recipe_id]), {})
+
+        self.assertEqual(like_buffer.flush(), 2)
+        self.assertFalse(RecipeLike.objects.exists())
+        self.assertEqual(like_buffer.get_pending_states([recipe_id]), {})
+
+        # A flush whose lock expired and was taken over leaves the new one be
+        client.set(like_buffer.FLUSH_LOCK_KEY, 'other')
+        self.assertEqual(like_buffer.flush(), 0)
+        like_buffer.release_flush_lock(client, 'mine')
+        self.assertEqual(client.get(like_buffer.FLUSH_LOCK_KEY), b'other')
+        self.assertFalse(client.exists(like_buffer.FLUSHING_KEY, like_buffer.DIRTY_KEY))
+
+    def test_recipe_user_flags(self):
+        """Lists flag the recipes the current user liked or bookmarked"""
+        access_token = self.login_functionality()
+        liked_id = self.create_recipe_functionality(access_token).data['id']
+        bookmarked_id = self.create_recipe_functionality(access_token).data['id']
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipe/{liked_id}/like/')
+            self.client.post(f'/api/user/profile/{self.user.id}/bookmarks/',
+                             {'id': bookmarked_id}, format='json')
+
+        with self.assertNumQueries(5):  # validators + COUNT + rows + 2 flags
+            response = self.client.get('/api/recipe/?page_size=10')
+        flags = {item['id']: (item['liked_by_me'], item['bookmarked_by_me'])
+                 for item in response.data['results']}
+        self.assertEqual(flags, {liked_id: (True, False), bookmarked_id: (False, True)})
+
+        # The cached page is shared without leaking the flags
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/recipe/?page_size=10')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertFalse(any(item['liked_by_me'] or item['bookmarked_by_me']
+                             for item in response.data['results']))
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipe/?page_size=10')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual({item['id']: item['liked_by_me'] for item in response.data['results']},
+                         {liked_id: True, bookmarked_id: False})
+        self.assertTrue(self.client.get(f'/api/recipe/{liked_id}/').data['liked_by_me'])
+
+        # Shared caches key these responses on both credentials
+        for url in ('/api/recipe/', f'/api/recipe/{liked_id}/', '/api/recipe/trending/'):
+            vary = self.client.get(url)['Vary'].split(', ')
+            self.assertTrue({'Authorization', 'Cookie'} <= set(vary))
+
+    def test_trending_recipes(self):
+        """Recent likes outweigh older ones and are only scored once"""
+        other_user = CustomUser.objects.create_user(
+            username='other', email='other@example.com', password='otherpass')
+        category = RecipeCategory.objects.create(name='Dinner')
+        old, recent = [
+            Recipe.objects.create(
+                author=self.user, category=category, picture='uploads/x.jpg',
+                title=title, desc=title, cook_time='00:30:00',
+                ingredients='Rice', procedure='Boil')
+            for title in ('Old', 'Recent')
+        ]
+        now = timezone.now()
+        for user in (self.user, other_user):
+            like = RecipeLike.objects.create(user=user, recipe=old)
+            RecipeLike.objects.filter(id=like.id).update(created=now - timedelta(days=1))
+        like = RecipeLike.objects.create(user=self.user, recipe=recent)
+        RecipeLike.objects.filter(id=like.id).update(created=now - timedelta(minutes=5))
+
+        self.assertEqual(trending.update_trending_scores(now), 3)
+        self.assertEqual(trending.update_trending_scores(now), 0)
+        response = self.client.get('/api/recipe/trending/')
+        self.assertEqual([item['id'] for item in response.data], [recent.id, old.id])
+        self.assertAlmostEqual(response.data[0]['trending_score'], 1, places=1)
+
+        # Later likes add to the stored scores
+        like = RecipeLike.objects.create(user=other_user, recipe=recent)
+        RecipeLike.objects.filter(id=like.id).update(created=now - timedelta(minutes=1))
+        self.assertEqual(trending.update_trending_scores(now), 1)
+        response = self.client.get('/api/recipe/trending/')
+        self.assertAlmostEqual(response.data[0]['trending_score'], 2, places=1)
+
+        self.assertEqual(self.client.get('/api/recipe/trending/?limit=0').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_similar_recipes(self):
+        """Recipes liked by the same users are recommended, best match first"""
+        category = RecipeCategory.objects.create(name='Dinner')
+        soup, stew, salad, cake = [
+            Recipe.objects.create(
+                author=self.user, category=category, picture='uploads/x.jpg',
+                title=title, desc=title, cook_time='00:30:00',
+                ingredients='Rice', procedure='Boil')
+            for title in ('Soup', 'Stew', 'Salad', 'Cake')
+        ]
+        users = [CustomUser.objects.create_user(
+            username=f'user{index}', email=f'user{index}@example.com', password='pass')
+            for index in range(3)]
+        for user, recipes in zip(users, ([soup, stew, salad], [soup, stew], [cake])):
+            for recipe in recipes:
+                RecipeLike.objects.create(user=user, recipe=recipe)
+
+        self.assertEqual(similarity.build_similar_recipes(k=2), 6)
+        response = self.client.get(f'/api/recipe/{soup.id}/similar/')
+        self.assertEqual([item['id'] for item in response.data], [stew.id, salad.id])
+        self.assertAlmostEqual(response.data[0]['similarity'], 1.0)
+        self.assertEqual(self.client.get(f'/api/recipe/{cake.id}/similar/').data, [])
+        self.assertEqual(self.client.get('/api/recipe/999/similar/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_recipe_categories(self):
+        """Categories are unique by name and listed with their recipe counts"""
+        access_token = self.login_functionality()
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe_id = self.create_recipe_functionality(access_token).data['id']
+            self.create_recipe_functionality(access_token)
+        self.client.credentials()
+        self.assertEqual(RecipeCategory.objects.filter(name='Lunch').count(), 1)
+
+        response = self.client.get('/api/recipe/categories/')
+        self.assertEqual([(row['name'], row['number_of_recipes']) for row in response.data],
+                         [('Lunch', 2)])
+        with self.assertNumQueries(0):
+            self.client.get('/api/recipe/categories/')
+
+        # Editing a recipe's category moves it instead of renaming Lunch
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipe/{recipe_id}/', {'category.name': 'Dinner'}, format='multipart')
+        self.assertEqual(response.data['category']['name'], 'Dinner')
+        response = self.client.get('/api/recipe/categories/')
+        self.assertEqual([(row['name'], row['number_of_recipes']) for row in response.data],
+                         [('Dinner', 1), ('Lunch', 1)])
+
+        # Recipe writes recount only the categories they touched
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipe/{recipe_id}/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/recipe/categories/')
+        self.assertEqual([(row['name'], row['number_of_recipes']) for row in response.data],
+                         [('Dinner', 0), ('Lunch', 1)])
+
+        # A category created in a rolled back transaction is never cached
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                get_category('Brunch')
+                categories.get()
+                RecipeCategory.objects.create(name='Lunch')
+        self.assertNotIn('Brunch', categories.get())
+
+    def test_recipe_picture_variants(self):
+        """Pictures are processed after the create commits: upright, without EXIF, in fixed widths"""
+        access_token = self.login_functionality()
+        image = Image.new('RGB', (1500, 1000))
+        exif = image.getexif()
+        exif[0x0112] = 6  # Orientation: rotated 90 degrees
+        picture = BytesIO()
+        image.save(picture, format='JPEG', exif=exif.tobytes())
+        data = {
+            "title": "Test Recipe",
+            "desc": "A short description of the test recipe.",
+            "cook_time": "01:00:00",
+            "ingredients": "Sugar, Flour, Butter",
+            "procedure": "Mix and bake",
+            "picture": SimpleUploadedFile(name='photo.jpg', content=picture.getvalue(),
+                                          content_type='image/jpeg'),
+            "category.name": "Lunch",
+        }
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/recipe/create/', data, format='multipart')
+            self.assertEqual(response.data['picture_variants'], {})
+
+            variants = self.client.get(f'/api/recipe/{response.data["id"]}/').data['picture_variants']
+            self.assertEqual((variants['width'], variants['height']), (1000, 1500))
+            for key in ('jpeg', 'webp'):
+                candidates = variants['srcset'][key].split(', ')
+                self.assertEqual([candidate.split(' ')[1] for candidate in candidates],
+                                 ['320w', '640w'])
+                self.assertTrue(candidates[0].startswith('http://testserver/media/blobs/'))
+            recipe = Recipe.objects.get(id=response.data['id'])
+            with Image.open(recipe.picture.path) as original:
+                self.assertEqual(original.size, (1000, 1500))
+                self.assertFalse(original.getexif())
+            list_variants = self.client.get('/api/recipe/').data['results'][0]['picture_variants']
+            self.assertEqual(list_variants, variants)
+
+    def test_media_deduplication(self):
+        """Identical uploads are stored once and collected when no recipe uses them"""
+        access_token = self.login_functionality()
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, MEDIA_BLOB_GC_GRACE=0):
+            first = self.create_recipe_functionality(access_token).data
+            second = self.create_recipe_functionality(access_token).data
+            self.assertEqual(first['picture'], second['picture'])
+            blob = MediaBlob.objects.get()
+            self.assertEqual(blob.refcount, 2)
+            self.assertTrue(storage.media_storage.exists(blob.name))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(f'/api/recipe/{first["id"]}/')
+            self.assertEqual(storage.collect_media_blobs(), 0)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(f'/api/recipe/{second["id"]}/')
+            self.assertEqual(storage.collect_media_blobs(), 1)
+            self.assertFalse(MediaBlob.objects.exists())
+            self.assertFalse(storage.media_storage.exists(blob.name))
+
+    def test_legacy_picture_release(self):
+        """Files from before deduplication are deleted only from their own field's folder, once unused"""
+        category = RecipeCategory.objects.create(name='Old')
+        recipes = []
+        for name in ('uploads/old.jpg', 'uploads/old.jpg', 'avatar/victim.jpg'):
+            path = storage.media_storage.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'old')
+            recipes.append(Recipe.objects.create(
+                author=self.user, category=category, picture=name, title='Old', desc='Old',
+                cook_time='00:10:00', ingredients='Salt', procedure='Mix'))
+        shared, other, stolen = recipes
+
+        with self.captureOnCommitCallbacks(execute=True):
+            shared.delete()
+            stolen.delete()
+        self.assertTrue(storage.media_storage.exists('uploads/old.jpg'))
+        self.assertTrue(storage.media_storage.exists('avatar/victim.jpg'))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertFalse(storage.media_storage.exists('uploads/old.jpg'))
+
+    def test_resumable_upload(self):
+        """Pictures can be sent in chunks, resumed at the reported offset and used for a recipe"""
+        access_token = self.login_functionality()
+        content = self.get_temporary_image().read()
+        half = len(content) // 2
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root, UPLOAD_SESSION_DIR=os.path.join(media_root, 'sessions')):
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+            response = self.client.post('/api/recipe/uploads/',
+                                        {'filename': 'photo.jpg', 'size': len(content)}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            url = f'/api/recipe/uploads/{response.data["id"]}/'
+
+            def send(chunk, offset):
+                return self.client.patch(url, chunk, content_type='application/offset+octet-stream',
+                                         HTTP_UPLOAD_OFFSET=str(offset))
+
+            self.assertEqual(send(content[:half], 0).data['offset'], half)
+            # A retried chunk is told where to resume instead of being written twice
+            response = send(content[:half], 0)
+            self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+            self.assertEqual(response['Upload-Offset'], str(half))
+            self.assertEqual(self.client.get(url).data['offset'], half)
+            self.assertTrue(send(content[half:], half).data['complete'])
+            # Retrying the last chunk leaves the finished upload alone
+            response = send(content[half:], half)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['complete'])
+            self.assertEqual(response['Upload-Offset'], str(len(content)))
+            session = UploadSession.objects.get()
+            self.assertEqual(MediaBlob.objects.get(name=session.name).refcount, 1)
+
+            data = {
+                "title": "Test Recipe",
+                "desc": "A short description of the test recipe.",
+                "cook_time": "01:00:00",
+                "ingredients": "Sugar, Flour, Butter",
+                "procedure": "Mix and bake",
+                "upload": url.split('/')[-2],
+                "category.name": "Lunch",
+            }
+            response = self.client.post('/api/recipe/create/', data, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            recipe = Recipe.objects.get(id=response.data['id'])
+            with recipe.picture.open('rb') as picture:
+                self.assertEqual(picture.read(), content)
+            self.assertFalse(UploadSession.objects.exists())
+
+            # The session was handed over and cannot be claimed again
+            response = self.client.post('/api/recipe/create/', data, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+            with override_settings(UPLOAD_MAX_SESSIONS=1):
+                self.client.post('/api/recipe/uploads/', {'filename': 'a.jpg', 'size': 1},
+                                 format='json')
+                response = self.client.post('/api/recipe/uploads/',
+                                            {'filename': 'b.jpg', 'size': 1}, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(os.listdir(os.path.join(media_root, 'sessions')), [])
@@ -0,0 +1,139 @@
+"""
+Trending recipes: like counts with exponential time decay.
+
+A like made at time t weighs 2 ** ((t - epoch) / half-life). At any later
+time every score is decayed by the same factor, so scores can be stored
+undecayed, ranked as they are and only scaled to their current value
+for display. When the exponents grow too large the epoch is moved forward
+and all scores are rescaled once.
+
+`update_trending_scores` runs from Celery beat and folds in the likes
+created since its watermark. Unlikes are not subtracted, their weight
+decays like any other; `rebuild_trending_scores` recomputes everything.
+
+The watermark is a like id, so a like whose transaction commits more
+than SETTLE_DELAY after it got its id is behind the watermark by then
+and skipped. The nightly rebuild counts those likes again.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import RecipeLike, RecipeTrendingScore, RecipeTrendingState
+
+# Rebase before 2 ** exponent gets anywhere near the float range
+MAX_EXPONENT = 256
+# Likes younger than this may still be in uncommitted transactions with
+# lower ids, so they are left for the next run.
+SETTLE_DELAY = 5
+# Scores decayed below this are dropped from the table
+MIN_SCORE = 0.01
+BATCH_SIZE = 5000
+# Score rows read and written per statement
+WRITE_BATCH_SIZE = 500
+
+
+def get_exponent(moment, epoch):
+    return (moment - epoch).total_seconds() / settings.RECIPE_TRENDING_HALF_LIFE
+
+
+def get_decay(state, now=None):
+    """
+    Factor turning stored scores into their current value.
+    """
+    return 2 ** -get_exponent(now or timezone.now(), state.epoch)
+
+
+def get_state(now):
+    state, _ = RecipeTrendingState.objects.select_for_update().get_or_create(
+        pk=1, defaults={'epoch': now})
+    return state
+
+
+def rebase(state, now):
+    """
+    Move the epoch to `now`, rescaling every stored score.
+    """
+    RecipeTrendingScore.objects.update(score=F('score') * get_decay(state, now))
+    state.epoch = now
+    state.save(update_fields=['epoch'])
+
+
+def add_scores(weights):
+    """
+    Add {recipe_id: weight} to the stored scores, WRITE_BATCH_SIZE rows at
+    a time. Callers hold the state row lock, so nobody else writes scores
+    between the read and the write.
+    """
+    recipe_ids = list(weights)
+    for start in range(0, len(recipe_ids), WRITE_BATCH_SIZE):
+        batch = recipe_ids[start:start + WRITE_BATCH_SIZE]
+        rows = RecipeTrendingScore.objects.in_bulk(batch)
+        for row in rows.values():
+            row.score += weights[row.pk]
+        RecipeTrendingScore.objects.bulk_update(rows.values(), ['score'])
+        RecipeTrendingScore.objects.bulk_create([
+            RecipeTrendingScore(recipe_id=recipe_id, score=weights[recipe_id])
+            for recipe_id in batch if recipe_id not in rows])
+
+
+def update_trending_scores(now=None, batch_size=BATCH_SIZE):
+    """
+    Fold the likes created since the watermark into the scores and drop
+    the scores that decayed away. Returns the number of likes processed.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=SETTLE_DELAY)
+    processed = 0
+    with transaction.atomic():
+        state = get_state(now)
+        if get_exponent(now, state.epoch) > MAX_EXPONENT:
+            rebase(state, now)
+        while True:
+            likes = list(RecipeLike.objects.filter(
+                id__gt=state.last_like_id, created__lte=cutoff,
+            ).order_by('id').values_list('id', 'recipe_id', 'created')[:batch_size])
+            if not likes:
+                break
+            weights = defaultdict(float)
+            for _, recipe_id, created in likes:
+                weights[recipe_id] += 2 ** get_exponent(created, state.epoch)
+            add_scores(weights)
+            state.last_like_id = likes[-1][0]
+            processed += len(likes)
+        state.save(update_fields=['last_like_id'])
+        RecipeTrendingScore.objects.filter(
+            score__lt=MIN_SCORE / get_decay(state, now)).delete()
+    return processed
+
+
+def rebuild_trending_scores(now=None):
+    """
+    Recompute every score from scratch, dropping unliked recipes.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        state = get_state(now)
+        RecipeTrendingScore.objects.all().delete()
+        state.epoch = now
+        state.last_like_id = 0
+        state.save()
+        return update_trending_scores(now)
+
+
+def get_trending(limit):
+    """
+    Returns [(recipe, current score)] of the top recipes, from one query
+    on the score index.
+    """
+    state = RecipeTrendingState.objects.filter(pk=1).first()
+    if state is None:
+        return []
+    decay = get_decay(state)
+    rows = RecipeTrendingScore.objects.select_related(
+        'recipe__category', 'recipe__author').order_by('-score')[:limit]
+    return [(row.recipe, row.score * decay) for row in rows]
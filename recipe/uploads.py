@@ -0,0 +1,146 @@
+"""
+Resumable chunked uploads.
+
+A client opens a session with the file's name and size, then sends the
+bytes in any number of PATCH requests, each starting at the offset the
+server reports. Every chunk is streamed straight to a partial file under
+UPLOAD_SESSION_DIR, and the bytes of an interrupted request are kept, so
+a retry resends only what is missing. Once the last byte arrives the file
+is checked to be an image and moved into the media storage. Its id can
+then be passed as `upload` in place of a recipe picture or an avatar.
+
+Sessions idle or unclaimed for UPLOAD_SESSION_TIMEOUT are removed by the
+expire_upload_sessions task.
+"""
+import fcntl
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from .models import UploadSession
+from .storage import media_storage
+
+READ_SIZE = 64 * 1024
+
+
+class UploadOffsetMismatch(Exception):
+    """
+    A chunk does not start where the received bytes end.
+    """
+
+
+class PartFile(File):
+    """
+    A finished partial file, moved into the storage rather than copied.
+    """
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_part_path(session):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f'{session.pk}.part')
+
+
+def delete_part(session):
+    try:
+        os.remove(get_part_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def append_chunk(session, offset, stream):
+    """
+    Write the bytes of `stream` at `offset` and record how many arrived,
+    including those of a request cut short. Returns the new offset.
+
+    Writers to a session hold an exclusive lock on its partial file for the
+    whole write and the completion, and check the session again once they
+    have it. A second request for the same range waits and then gets a
+    mismatch instead of truncating the first one's bytes, and a chunk
+    arriving after the completion changes nothing.
+    """
+    if offset != session.offset:
+        raise UploadOffsetMismatch
+    path = get_part_path(session)
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    received = 0
+    # Opened without truncating, a concurrent writer may hold it already
+    with os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b') as part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        current = UploadSession.objects.filter(pk=session.pk).values_list(
+            'offset', 'name').first()
+        if current is None or current[1]:
+            # Completed, or expired, while this request waited. The open
+            # above created the partial file again
+            delete_part(session)
+            session.offset, session.name = current or (offset, '')
+            return session.offset
+        if current[0] != offset:
+            raise UploadOffsetMismatch
+        try:
+            part.seek(offset)
+            # Drop whatever an interrupted write left past the offset
+            part.truncate()
+            while stream is not None:
+                chunk = stream.read(READ_SIZE)
+                if not chunk:
+                    break
+                if offset + received + len(chunk) > session.size:
+                    raise ValidationError('The upload is larger than its declared size.')
+                part.write(chunk)
+                received += len(chunk)
+        finally:
+            if received:
+                part.flush()
+                UploadSession.objects.filter(pk=session.pk, offset=offset).update(
+                    offset=offset + received, updated_at=timezone.now())
+        session.offset = offset + received
+        if session.offset == session.size:
+            complete(session)
+    return session.offset
+
+
+def complete(session):
+    """
+    Check the received file is an image and move it into the media storage.
+    Called with the partial file locked.
+    """
+    path = get_part_path(session)
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        delete_part(session)
+        session.delete()
+        raise ValidationError(
+            'Upload a valid image. The file you uploaded was either not an '
+            'image or a corrupted image.')
+    with open(path, 'rb') as part:
+        session.name = media_storage.save(f'uploads/{session.filename}', PartFile(part))
+    # Left behind when the storage already held the same bytes
+    delete_part(session)
+    session.save(update_fields=['name', 'updated_at'])
+
+
+def expire_upload_sessions():
+    """
+    Delete the sessions idle for longer than UPLOAD_SESSION_TIMEOUT with
+    their partial files, releasing the files nobody claimed. Returns the
+    number of sessions deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TIMEOUT)
+    with transaction.atomic():
+        # Sessions being claimed right now are locked and left alone
+        sessions = list(UploadSession.objects.select_for_update(skip_locked=True).filter(
+            updated_at__lt=cutoff))
+        UploadSession.objects.filter(pk__in=[session.pk for session in sessions]).delete()
+        media_storage.delete_many([session.name for session in sessions])
+    for session in sessions:
+        delete_part(session)
+    return len(sessions)
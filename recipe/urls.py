@@ -7,7 +7,21 @@ app_name = 'recipe'
 urlpatterns = [
     path('', views.RecipeListAPIView.as_view(), name="recipe-list"),
     path('<int:pk>/', views.RecipeAPIView.as_view(), name="recipe-detail"),
+    path('<int:pk>/similar/', views.RecipeSimilarAPIView.as_view(),
+         name="recipe-similar"),
+    path('categories/', views.RecipeCategoryListAPIView.as_view(),
+         name="recipe-categories"),
+    path('search/', views.RecipeSearchAPIView.as_view(), name="recipe-search"),
+    path('trending/', views.RecipeTrendingAPIView.as_view(), name="recipe-trending"),
+    path('cook-with/', views.RecipeCookWithAPIView.as_view(),
+         name="recipe-cook-with"),
+    path('cache/stats/', views.RecipeListCacheStatsAPIView.as_view(),
+         name="recipe-cache-stats"),
     path('create/', views.RecipeCreateAPIView.as_view(), name="recipe-create"),
+    path('uploads/', views.UploadSessionCreateAPIView.as_view(), name="upload-create"),
+    path('uploads/<uuid:pk>/', views.UploadSessionAPIView.as_view(), name="upload-detail"),
+    path('import/', views.RecipeImportAPIView.as_view(), name="recipe-import"),
+    path('export/', views.RecipeExportAPIView.as_view(), name="recipe-export"),
     path('<int:pk>/like/', views.RecipeLikeAPIView.as_view(),
          name='recipe-like'),
 ]
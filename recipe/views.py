@@ -1,31 +1,255 @@
-from rest_framework import generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.shortcuts import get_object_or_404
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema, inline_serializer
+from rest_framework import generics, serializers, status
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404, StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from redis.exceptions import RedisError
 
-from .models import Recipe, RecipeLike
-from .serializers import RecipeLikeSerializer, RecipeSerializer
+from .cache import (
+    get_cached_list, get_list_cache_stats, get_recipe_detail, invalidate_recipes,
+    is_list_cacheable, record_list_hit, record_list_miss, set_cached_list)
+from .categories import get_categories
+from .conditional import (
+    NotModified, add_user_to_validators, get_list_validators, get_not_modified_response,
+    get_page_validators, get_recipe_validators, set_validators, vary_on_user)
+from .models import (
+    Recipe, RecipeLike, SimilarRecipe, UploadSession, get_number_of_likes_using_recipe_id)
+from .serializers import (
+    LIST_COLUMNS, RecipeCategoryCountSerializer, RecipeLikeSerializer,
+    RecipeListCacheStatsSerializer, RecipeListSerializer, RecipeSerializer,
+    UploadSessionSerializer, add_user_flags, get_sparse_field_names, prune_queryset,
+    strip_user_flags)
 from .permissions import IsAuthorOrReadOnly
-from rest_framework.pagination import PageNumberPagination
+from .pagination import KeysetPagination, RecipeCursorPagination, RecipePagination
+from .exporter import EXPORT_FORMATS, export_recipes
+from .images import make_srcset_absolute, process_on_commit
+from .importer import import_recipes
+from .ingredients import find_recipes_by_ingredients
+from .like_buffer import add_buffer_version, merge_like_counts, record_like
+from .search import search_recipes
+from .tasks import process_recipe_picture
+from .uploads import UploadOffsetMismatch, append_chunk
+from .trending import get_trending
 
-class RecipePagination(PageNumberPagination):
-    page_size = 2  # Number of items per page
-    page_size_query_param = 'page_size'
-    max_page_size = 100
 
 class RecipeListAPIView(generics.ListAPIView):
     """
     A viewset for viewing and editing recipe instances.
+
+    Pass `?pagination=cursor` (or a `cursor`) to opt in to keyset paging,
+    which skips the total count and costs the same on every page.
+    `?fields=` and `?omit=` prune the returned fields and fetched columns.
     """
-    serializer_class = RecipeSerializer
+    serializer_class = RecipeListSerializer
     permission_classes = (AllowAny,)
     pagination_class = RecipePagination
+    cursor_pagination_class = RecipeCursorPagination
     filterset_fields = ('category__name', 'author__username')
 
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params if self.request else {}
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = self.cursor_pagination_class()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
-        # Use select_related to optimize foreign key lookups
-        queryset = Recipe.objects.select_related('category', 'author').all()
-        return queryset
+        return prune_queryset(Recipe.objects.all(), self.get_serializer(), LIST_COLUMNS)
+
+    def get_response_validators(self, validators):
+        return add_buffer_version(add_user_to_validators(validators, self.request))
+
+    def list(self, request, *args, **kwargs):
+        # Entries are shared by all users: the per-user flags are left out
+        # of them and added back to every response.
+        cacheable = is_list_cacheable(request)
+        if cacheable:
+            entry = get_cached_list(request)
+            if entry is not None:
+                record_list_hit()
+                validators = self.get_response_validators(
+                    (entry['etag'], entry['last_modified']))
+                response = get_not_modified_response(request, *validators)
+                if response is None:
+                    results = entry['data']['results']
+                    merge_like_counts(results)
+                    add_user_flags(results, entry['ids'], request)
+                    response = Response(entry['data'])
+                response['X-Cache'] = 'HIT'
+                return set_validators(response, *validators)
+            record_list_miss()
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = None
+        if isinstance(self.paginator, KeysetPagination):
+            page = self.paginate_queryset(queryset)
+            validators = get_page_validators(page, request)
+        else:
+            validators = get_list_validators(queryset, request)
+        response_validators = self.get_response_validators(validators)
+        response = get_not_modified_response(request, *response_validators)
+        if response is None:
+            if page is None:
+                page = self.paginate_queryset(queryset)
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+            if cacheable:
+                data = dict(response.data, results=strip_user_flags(response.data['results']))
+                set_cached_list(request, data, page, *validators)
+            merge_like_counts(response.data['results'])
+        if cacheable:
+            response['X-Cache'] = 'MISS'
+        return set_validators(response, *response_validators)
+
+
+class RecipeCategoryListAPIView(generics.ListAPIView):
+    """
+    Every category with its number of recipes, served from the category cache
+    """
+    serializer_class = RecipeCategoryCountSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = None
+    filter_backends = ()
+
+    def get_queryset(self):
+        return get_categories()
+
+
+class RecipeListCacheStatsAPIView(generics.GenericAPIView):
+    """
+    Hit/miss counters of the recipe list cache
+    """
+    permission_classes = (IsAdminUser,)
+    serializer_class = RecipeListCacheStatsSerializer
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_list_cache_stats())
+
+
+@vary_on_user
+class RecipeSearchAPIView(generics.ListAPIView):
+    """
+    Full-text search over title, description, ingredients and procedure,
+    ranked by BM25: /api/recipe/search/?q=...
+    """
+    serializer_class = RecipeListSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = RecipePagination
+
+    def get_queryset(self):
+        return search_recipes(self.request.query_params.get('q', ''))
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        ids = [row['recipe_id'] for row in page]
+        recipes = prune_queryset(Recipe.objects.all(), self.get_serializer()).in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[id] for id in ids if id in recipes], many=True)
+        return self.get_paginated_response(merge_like_counts(serializer.data))
+
+
+@vary_on_user
+class RecipeCookWithAPIView(generics.ListAPIView):
+    """
+    Recipes you can cook with the given ingredients, best coverage first:
+    /api/recipe/cook-with/?ingredients=flour,sugar&max_missing=2
+    """
+    serializer_class = RecipeListSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = RecipePagination
+    max_missing_limit = 10
+
+    def get_max_missing(self):
+        try:
+            max_missing = int(self.request.query_params.get('max_missing', 2))
+        except ValueError:
+            raise ValidationError({'max_missing': 'A valid integer is required.'})
+        if not 0 <= max_missing <= self.max_missing_limit:
+            raise ValidationError({'max_missing': (
+                f'Must be between 0 and {self.max_missing_limit}.')})
+        return max_missing
+
+    def get_queryset(self):
+        names = self.request.query_params.get('ingredients', '').split(',')
+        return find_recipes_by_ingredients(
+            [name for name in names if name.strip()], self.get_max_missing())
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        recipes = prune_queryset(Recipe.objects.all(), self.get_serializer()).in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        page = [row for row in page if row[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True).data
+        for item, (_, matched, missing) in zip(data, page):
+            item['matched_ingredients'] = matched
+            item['missing_ingredients'] = missing
+        return self.get_paginated_response(merge_like_counts(data))
+
+
+class LimitMixin:
+    """
+    Reads a bounded `?limit=` for endpoints returning a top-N list.
+    """
+    default_limit = 20
+    max_limit = 100
+
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'A valid integer is required.'})
+        if not 1 <= limit <= self.max_limit:
+            raise ValidationError({'limit': f'Must be between 1 and {self.max_limit}.'})
+        return limit
+
+
+@vary_on_user
+class RecipeTrendingAPIView(LimitMixin, generics.ListAPIView):
+    """
+    Recipes ranked by time-decayed likes: /api/recipe/trending/?limit=20
+    """
+    serializer_class = RecipeListSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        trending = get_trending(self.get_limit())
+        data = self.get_serializer([recipe for recipe, _ in trending], many=True).data
+        for item, (_, score) in zip(data, trending):
+            item['trending_score'] = round(score, 4)
+        return Response(merge_like_counts(data))
+
+
+@vary_on_user
+class RecipeSimilarAPIView(LimitMixin, generics.ListAPIView):
+    """
+    Recipes liked by the same users: /api/recipe/<pk>/similar/?limit=20
+    """
+    serializer_class = RecipeListSerializer
+    permission_classes = (AllowAny,)
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        neighbours = list(SimilarRecipe.objects.filter(
+            recipe_id=self.kwargs['pk']).select_related(
+            'similar_recipe__category', 'similar_recipe__author',
+        ).order_by('-score')[:self.get_limit()])
+        if not neighbours and not Recipe.objects.filter(id=self.kwargs['pk']).exists():
+            raise Http404
+        data = self.get_serializer(
+            [neighbour.similar_recipe for neighbour in neighbours], many=True).data
+        for item, neighbour in zip(data, neighbours):
+            item['similarity'] = round(neighbour.score, 4)
+        return Response(merge_like_counts(data))
+
 
 class RecipeCreateAPIView(generics.CreateAPIView):
     """
@@ -39,7 +263,105 @@ class RecipeCreateAPIView(generics.CreateAPIView):
         return Recipe.objects.select_related('category', 'author').all()
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        recipe = serializer.save(author=self.request.user)
+        process_on_commit(process_recipe_picture, recipe.pk, recipe.picture.name)
+
+class UploadSessionCreateAPIView(generics.CreateAPIView):
+    """
+    Open a resumable upload: {"filename": ..., "size": <bytes>}
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+class UploadSessionAPIView(generics.RetrieveAPIView):
+    """
+    Resume an upload: GET reports the bytes received so far, PATCH appends
+    the raw request body at the offset sent in the `Upload-Offset` header.
+    A chunk starting anywhere else gets a 409 with the current offset, one
+    sent to a completed upload a 200 with the final offset.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def patch(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            raise ValidationError({'Upload-Offset': 'A valid integer is required.'})
+        if session.is_complete:
+            # A retried last chunk, the upload is already done
+            response = Response(self.get_serializer(session).data)
+            response['Upload-Offset'] = session.offset
+            return response
+        try:
+            append_chunk(session, offset, request.stream)
+            response = Response(self.get_serializer(session).data)
+        except UploadOffsetMismatch:
+            session = self.get_object()
+            response = Response(self.get_serializer(session).data, status=status.HTTP_409_CONFLICT)
+        response['Upload-Offset'] = session.offset
+        return response
+
+
+class RecipeImportAPIView(generics.GenericAPIView):
+    """
+    Bulk create recipes from an NDJSON body, one recipe per line. The body
+    is read as a stream and invalid lines are reported without aborting
+    the import.
+    """
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(
+        request={'application/x-ndjson': OpenApiTypes.BINARY},
+        responses=inline_serializer('RecipeImportReport', {
+            'created': serializers.IntegerField(),
+            'failed': serializers.IntegerField(),
+            'errors': serializers.ListField(child=serializers.DictField()),
+        }))
+    def post(self, request, *args, **kwargs):
+        stream = request.stream
+        report = import_recipes(stream if stream is not None else (), request.user)
+        return Response(report)
+
+
+class RecipeExportAPIView(generics.GenericAPIView):
+    """
+    Stream every recipe: /api/recipe/export/?output=ndjson|csv&gzip=1
+    """
+    permission_classes = (IsAdminUser,)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('output', enum=list(EXPORT_FORMATS), default='ndjson'),
+            OpenApiParameter('gzip', bool, description='Compress the export with gzip.'),
+        ],
+        responses={
+            (200, 'application/x-ndjson'): OpenApiTypes.BINARY,
+            (200, 'text/csv'): OpenApiTypes.BINARY,
+            (200, 'application/gzip'): OpenApiTypes.BINARY,
+        })
+    def get(self, request, *args, **kwargs):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': f'Must be one of {", ".join(EXPORT_FORMATS)}.'})
+        compress = request.query_params.get('gzip') in ('1', 'true')
+        content_type, extension = EXPORT_FORMATS[output]
+        filename = f'recipes.{extension}'
+        if compress:
+            content_type = 'application/gzip'
+            filename += '.gz'
+        response = StreamingHttpResponse(
+            export_recipes(output, compress), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
 
 class RecipeAPIView(generics.RetrieveUpdateDestroyAPIView):
     """
@@ -52,29 +374,107 @@ class RecipeAPIView(generics.RetrieveUpdateDestroyAPIView):
         # Use select_related to optimize foreign key lookups
         return Recipe.objects.select_related('category', 'author').all()
 
+    def get_response_validators(self, validators):
+        return add_buffer_version(add_user_to_validators(validators, self.request))
+
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            recipe = self.get_object()
+            etag, last_modified = get_recipe_validators(recipe)
+            # A current client copy needs no serialization, nor an entry
+            validators = self.get_response_validators((etag, last_modified))
+            if get_not_modified_response(request, *validators) is not None:
+                raise NotModified(validators)
+            # Serialized without the request so the cached copy holds
+            # host-independent media URLs.
+            return {
+                'data': strip_user_flags([RecipeSerializer(recipe).data])[0],
+                'etag': etag,
+                'last_modified': last_modified,
+            }
+
+        try:
+            entry = get_recipe_detail(self.kwargs['pk'], build)
+        except NotModified as not_modified:
+            validators = not_modified.validators
+            return set_validators(
+                get_not_modified_response(request, *validators), *validators)
+        validators = self.get_response_validators((entry['etag'], entry['last_modified']))
+        response = get_not_modified_response(request, *validators)
+        if response is None:
+            data = dict(entry['data'])
+            if data['picture']:
+                data['picture'] = request.build_absolute_uri(data['picture'])
+            data['picture_variants'] = make_srcset_absolute(
+                data['picture_variants'], request.build_absolute_uri)
+            merge_like_counts([data])
+            add_user_flags([data], [self.kwargs['pk']], request)
+            names = get_sparse_field_names(data, request.query_params)
+            if len(names) != len(data):
+                data = {name: data[name] for name in names}
+            response = Response(data)
+        return set_validators(response, *validators)
+
+    def perform_update(self, serializer):
+        if 'picture' not in serializer.validated_data:
+            serializer.save()
+            return
+        # The variants of the previous picture no longer apply
+        recipe = serializer.save(picture_variants={})
+        process_on_commit(process_recipe_picture, recipe.pk, recipe.picture.name)
+
 class RecipeLikeAPIView(generics.CreateAPIView):
     """
-    Like, Dislike a recipe
+    Like, Dislike a recipe. Both are idempotent and return the new like
+    count: 201 when a like is created, 200 otherwise. With the like buffer
+    enabled the write is queued in Redis and answered with 202.
     """
     serializer_class = RecipeLikeSerializer
     permission_classes = (IsAuthenticated,)
 
+    def get_response(self, changed, number_of_likes, created=False):
+        if changed:
+            transaction.on_commit(lambda: invalidate_recipes([self.kwargs['pk']]))
+        return Response(
+            {'total_number_of_likes': number_of_likes},
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def buffer(self, request, pk, liked):
+        """
+        Queue the write in the like buffer. Returns None when Redis is
+        unavailable, to fall back to a direct write.
+        """
+        if get_number_of_likes_using_recipe_id(pk) is None:
+            raise Http404
+        try:
+            record_like(request.user.id, pk, liked)
+        except RedisError:
+            return None
+        data = merge_like_counts([{
+            'id': pk,
+            'total_number_of_likes': get_number_of_likes_using_recipe_id(pk),
+        }])[0]
+        return Response({'total_number_of_likes': data['total_number_of_likes']},
+                        status=status.HTTP_202_ACCEPTED)
+
     def post(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
-        new_like, created = RecipeLike.objects.get_or_create(
-            user=request.user, recipe=recipe)
-        if created:
-            new_like.save()
-            return Response(status=status.HTTP_201_CREATED)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        if settings.RECIPE_LIKE_BUFFER:
+            response = self.buffer(request, pk, liked=True)
+            if response is not None:
+                return response
+        try:
+            created, number_of_likes = RecipeLike.objects.like(request.user.id, pk)
+        except (Recipe.DoesNotExist, IntegrityError):
+            raise Http404
+        return self.get_response(created, number_of_likes, created=created)
 
     def delete(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
-        like = RecipeLike.objects.filter(user=request.user, recipe=recipe)
-        if like.exists():
-            like.delete()
-            return Response(status=status.HTTP_200_OK)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
-
-    def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        if settings.RECIPE_LIKE_BUFFER:
+            response = self.buffer(request, pk, liked=False)
+            if response is not None:
+                return response
+        try:
+            deleted, number_of_likes = RecipeLike.objects.unlike(request.user.id, pk)
+        except Recipe.DoesNotExist:
+            raise Http404
+        return self.get_response(deleted, number_of_likes)
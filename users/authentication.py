@@ -0,0 +1,186 @@
+"""
+JWT authentication without a user query per request.
+
+simplejwt's JWTAuthentication loads the user row on every request. Here
+the few columns authentication needs are looked up in an in-process LRU,
+then in Redis, and only then in the database. The request gets a
+CustomUser built from them, with the other columns (the password hash
+among them) deferred, so code that needs more still loads it on access.
+
+Saving or deleting a user drops its Redis entry and this process's copy.
+Other processes keep theirs for up to AUTH_USER_LOCAL_CACHE_TIMEOUT
+seconds, which bounds how long a deactivated user can go on.
+
+With JWT_STATELESS_USER the username and is_active are read from claims
+stamped into the tokens at login and on every refresh, so requests never
+touch the cache; refreshing re-reads the user.
+
+Refresh tokens are revoked in Redis, see users.blacklist.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+
+from .blacklist import blacklist_token, is_blacklisted
+
+User = get_user_model()
+
+# Columns kept in the caches, enough for authentication and permissions
+USER_FIELDS = ('id', 'username', 'email', 'is_active', 'is_staff', 'is_superuser')
+# Columns carried by the tokens in stateless mode
+CLAIM_FIELDS = ('username', 'is_active')
+
+
+def get_user_key(user_id):
+    return f'users:auth:{user_id}'
+
+
+class UserCache:
+    """
+    Bounded, short-lived map of user id -> cached columns.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > settings.AUTH_USER_LOCAL_CACHE_TIMEOUT:
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def set(self, user_id, fields):
+        with self.lock:
+            self.entries[user_id] = (time.monotonic(), fields)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > settings.AUTH_USER_LOCAL_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_users = UserCache()
+
+
+def get_user_fields(user_id):
+    """
+    Returns the cached columns of a user, or None when there is no such user.
+    """
+    fields = local_users.get(user_id)
+    if fields is None:
+        fields = cache.get(get_user_key(user_id))
+        if fields is None:
+            fields = User.objects.filter(pk=user_id).values(*USER_FIELDS).first()
+            if fields is None:
+                return None
+            cache.set(get_user_key(user_id), fields, settings.AUTH_USER_CACHE_TIMEOUT)
+        local_users.set(user_id, fields)
+    return fields
+
+
+def invalidate_user(user_id):
+    cache.delete(get_user_key(user_id))
+    local_users.delete(user_id)
+
+
+def build_user(fields):
+    """
+    A CustomUser holding `fields`, with every other column deferred.
+    """
+    # from_db takes the values in the order of the model's columns
+    names = [field.attname for field in User._meta.concrete_fields if field.attname in fields]
+    return User.from_db(router.db_for_read(User), names, [fields[name] for name in names])
+
+
+def set_user_claims(token, fields):
+    for name in CLAIM_FIELDS:
+        token[name] = fields[name]
+
+
+class UserRefreshToken(RefreshToken):
+    """
+    Refresh token carrying the user claims and revoked in Redis instead of
+    the token_blacklist tables.
+    """
+    def check_blacklist(self):
+        if is_blacklisted(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+    def blacklist(self):
+        blacklist_token(self.payload[api_settings.JTI_CLAIM], self.payload['exp'])
+
+    @classmethod
+    def for_user(cls, user):
+        # Skips BlacklistMixin, which records every token in OutstandingToken
+        token = super(BlacklistMixin, cls).for_user(user)
+        set_user_claims(token, {name: getattr(user, name) for name in CLAIM_FIELDS})
+        return token
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        if settings.JWT_STATELESS_USER and all(name in validated_token for name in CLAIM_FIELDS):
+            fields = {'id': user_id}
+            fields.update((name, validated_token[name]) for name in CLAIM_FIELDS)
+        else:
+            fields = get_user_fields(user_id)
+            if fields is None:
+                raise AuthenticationFailed(_('User not found'), code='user_not_found')
+
+        if not fields['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return build_user(fields)
+
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refreshes only for users that still exist and are active, and stamps
+    their current claims into the new tokens.
+    """
+    def validate(self, attrs):
+        refresh = UserRefreshToken(attrs['refresh'])
+        fields = get_user_fields(refresh[api_settings.USER_ID_CLAIM])
+        if fields is None or not fields['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        set_user_claims(refresh, fields)
+
+        data = {'access': str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+
+            data['refresh'] = str(refresh)
+
+        return data
@@ -0,0 +1,151 @@
+"""
+Refresh-token blacklist in Redis.
+
+simplejwt's blacklist app writes an OutstandingToken row for every issued
+refresh token and a BlacklistedToken row for every rotation and logout,
+and checks the blacklist with a join on every refresh. Here a revoked
+token's jti is a Redis key that expires with the token, so the set holds
+only tokens that could still be used and a check is one EXISTS.
+
+With JWT_BLACKLIST_BLOOM each process also keeps a Bloom filter of the
+revoked jtis, so most checks of tokens that were never revoked skip Redis.
+Revocations are logged in a sorted set that every process folds into its
+filter at least every JWT_BLACKLIST_BLOOM_SYNC_INTERVAL seconds, which
+bounds how long a token revoked by another process may still be accepted.
+A filter hit is always confirmed in Redis.
+
+The rows simplejwt already wrote are deleted by `flush_expired_tokens`,
+in batches, once their tokens have expired.
+
+Redis keys:
+    users:blacklist:<jti>   present while the revoked token has not expired
+    users:blacklist:log     sorted set of revoked jtis by revocation time
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+KEY_PREFIX = 'users:blacklist'
+LOG_KEY = f'{KEY_PREFIX}:log'
+FLUSH_BATCH_SIZE = 1000
+
+
+def get_client():
+    return get_redis_connection('default')
+
+
+def jti_key(jti):
+    return f'{KEY_PREFIX}:{jti}'
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return ((first + index * second) % self.size for index in range(self.hashes))
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(item))
+
+
+class BlacklistFilter:
+    """
+    This process's Bloom filter of revoked jtis, caught up from the log.
+    Rebuilt from scratch every refresh-token lifetime so expired jtis
+    leave it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+
+    def clear(self):
+        with self.lock:
+            self.filter = None
+
+    def sync(self, now):
+        lifetime = api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+        if self.filter is None or now - self.built_at > lifetime:
+            self.filter = BloomFilter(settings.JWT_BLACKLIST_BLOOM_CAPACITY,
+                                      settings.JWT_BLACKLIST_BLOOM_ERROR_RATE)
+            self.built_at = now
+            self.synced_at = now - lifetime
+        elif now - self.synced_at <= settings.JWT_BLACKLIST_BLOOM_SYNC_INTERVAL:
+            return
+        # Overlap the previous sync to catch entries logged with older clocks
+        since = self.synced_at - settings.JWT_BLACKLIST_BLOOM_SYNC_INTERVAL
+        for jti in get_client().zrangebyscore(LOG_KEY, since, '+inf'):
+            self.filter.add(jti.decode())
+        self.synced_at = now
+
+    def might_contain(self, jti):
+        with self.lock:
+            self.sync(time.time())
+            return jti in self.filter
+
+    def add(self, jti):
+        with self.lock:
+            if self.filter is not None:
+                self.filter.add(jti)
+
+
+revoked = BlacklistFilter()
+
+
+def blacklist_token(jti, exp):
+    """
+    Revoke a token until its `exp` (a unix timestamp).
+    """
+    now = time.time()
+    ttl = math.ceil(exp - now)
+    if ttl <= 0:
+        return
+    lifetime = api_settings.REFRESH_TOKEN_LIFETIME.total_seconds()
+    pipe = get_client().pipeline()
+    pipe.set(jti_key(jti), 1, ex=ttl)
+    pipe.zadd(LOG_KEY, {jti: now})
+    pipe.zremrangebyscore(LOG_KEY, '-inf', now - lifetime)
+    pipe.execute()
+    if settings.JWT_BLACKLIST_BLOOM:
+        revoked.add(jti)
+
+
+def is_blacklisted(jti):
+    if settings.JWT_BLACKLIST_BLOOM and not revoked.might_contain(jti):
+        return False
+    return bool(get_client().exists(jti_key(jti)))
+
+
+def flush_expired_tokens(batch_size=FLUSH_BATCH_SIZE):
+    """
+    Delete expired OutstandingToken rows, and their BlacklistedToken rows,
+    a batch per transaction. Returns the number of tokens deleted.
+    """
+    now = timezone.now()
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            ids = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by(
+                'expires_at').values_list('id', flat=True)[:batch_size])
+            OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
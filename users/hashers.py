@@ -0,0 +1,13 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with PASSWORD_HASH_ITERATIONS iterations. It shares its
+    algorithm name with Django's hasher, so existing hashes verify, and a
+    hash with another count is re-encoded on the next successful login.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
@@ -0,0 +1,83 @@
+import statistics
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+from django.urls import reverse
+
+EMAIL = 'benchmark-login@example.com'
+PASSWORD = 'benchmark-password'
+UNTHROTTLED = {'login_ip': None, 'login_email': None}
+
+
+class Command(BaseCommand):
+    help = ('Measure recipe-list latency in this process while threads post '
+            'failing logins, without and with the login protection.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attackers', type=int, default=16,
+                            help='Threads posting logins with a wrong password.')
+        parser.add_argument('--readers', type=int, default=4,
+                            help='Threads listing recipes.')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Seconds per phase.')
+
+    def handle(self, *args, **options):
+        user, _ = get_user_model().objects.get_or_create(
+            email=EMAIL, defaults={'username': 'benchmark-login'})
+        user.set_password(PASSWORD)
+        user.save(update_fields=['password'])
+
+        phases = (
+            ('idle', 0, {}),
+            ('attack, unprotected', options['attackers'], {
+                'LOGIN_THROTTLE_RATES': UNTHROTTLED,
+                'LOGIN_HASH_CONCURRENCY': options['attackers'],
+            }),
+            ('attack, hash limiter', options['attackers'], {
+                'LOGIN_THROTTLE_RATES': UNTHROTTLED,
+            }),
+            ('attack, limiter + throttle', options['attackers'], {}),
+        )
+        self.stdout.write(f'{"phase":<30}{"p50 (ms)":>10}{"p99 (ms)":>10}'
+                          f'{"reads":>8}{"logins":>8}')
+        for name, attackers, overrides in phases:
+            with override_settings(ALLOWED_HOSTS=['*'], **overrides):
+                p50, p99, reads, logins = self.run_phase(
+                    attackers, options['readers'], options['duration'])
+            self.stdout.write(f'{name:<30}{p50:>10.1f}{p99:>10.1f}{reads:>8}{logins:>8}')
+
+    def run_phase(self, attackers, readers, duration):
+        stop = threading.Event()
+        timings = []
+        statuses = []
+
+        def attack():
+            client = Client()
+            while not stop.is_set():
+                response = client.post(reverse('users:login-user'),
+                                       {'email': EMAIL, 'password': 'wrong'})
+                statuses.append(response.status_code)
+
+        def read():
+            client = Client()
+            while not stop.is_set():
+                started = time.perf_counter()
+                client.get(reverse('recipe:recipe-list'))
+                timings.append((time.perf_counter() - started) * 1000)
+
+        threads = [threading.Thread(target=attack) for _ in range(attackers)]
+        threads += [threading.Thread(target=read) for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        p99 = statistics.quantiles(timings, n=100)[98] if len(timings) > 1 else timings[0]
+        # Logins that reached the password check
+        hashed = sum(status == 400 for status in statuses)
+        return statistics.median(timings), p99, len(timings), hashed
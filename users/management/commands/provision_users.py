@@ -0,0 +1,33 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.provisioning import DEFAULT_BATCH_SIZE, provision_users
+
+
+class Command(BaseCommand):
+    help = ('Create users and their profiles in bulk from a CSV file with '
+            'email, username and optional password columns.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file with a header row, or '-' for stdin.")
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        def provision(lines):
+            reader = csv.DictReader(lines)
+            missing = {'email', 'username'} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Missing column(s): {', '.join(sorted(missing))}")
+            return provision_users(reader, options['batch_size'])
+
+        if options['path'] == '-':
+            report = provision(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8', newline='') as lines:
+                report = provision(lines)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report['created']} user(s), skipped {report['skipped']} "
+            f"already taken."))
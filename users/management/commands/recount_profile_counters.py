@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from users.models import Profile, count_profile_bookmarks_subquery
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized profile bookmark counters and repair drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of drifted profiles repaired per UPDATE statement.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many profiles have drifted.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drifted_ids = list(Profile.objects.annotate(
+            actual_bookmarks=count_profile_bookmarks_subquery(),
+        ).exclude(number_of_bookmarks=F('actual_bookmarks')).order_by().values_list(
+            'id', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(f'{len(drifted_ids)} profile(s) have drifted counters.')
+            return
+
+        for start in range(0, len(drifted_ids), batch_size):
+            with transaction.atomic():
+                Profile.objects.filter(id__in=drifted_ids[start:start + batch_size]).update(
+                    number_of_bookmarks=count_profile_bookmarks_subquery(),
+                    updated_at=timezone.now())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Repaired counters of {len(drifted_ids)} profile(s).'))
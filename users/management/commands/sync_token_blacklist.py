@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from users.blacklist import blacklist_token
+
+
+class Command(BaseCommand):
+    help = 'Copy the unexpired tokens of the token_blacklist tables to the Redis blacklist.'
+
+    def handle(self, *args, **options):
+        tokens = BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()).values_list('token__jti', 'token__expires_at')
+        copied = 0
+        for jti, expires_at in tokens.iterator():
+            blacklist_token(jti, expires_at.timestamp())
+            copied += 1
+        self.stdout.write(self.style.SUCCESS(f'Copied {copied} token(s).'))
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:34
+
+from django.db import migrations, models
+import recipe.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_profile_avatar_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(blank=True, storage=recipe.storage.ContentAddressedStorage(), upload_to='avatar'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0014_upload_session'),
+        ('users', '0012_profile_avatar_storage'),
+    ]
+
+    operations = [
+        # Adopt the existing many-to-many table as the Bookmark model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='Bookmark',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.profile')),
+                        ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='recipe.recipe')),
+                    ],
+                    options={
+                        'db_table': 'users_profile_bookmarks',
+                        'unique_together': {('profile', 'recipe')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='profile',
+                    name='bookmarks',
+                    field=models.ManyToManyField(related_name='bookmarked_by', through='users.Bookmark', to='recipe.Recipe'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='bookmark',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='bookmark',
+            index=models.Index(fields=['profile', '-created_at', '-id'], name='bookmark_profile_created_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:41
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Profile = apps.get_model('users', 'Profile')
+    Bookmark = apps.get_model('users', 'Bookmark')
+    bookmarks = Bookmark.objects.filter(profile=OuterRef('pk')).order_by()
+    Profile.objects.update(number_of_bookmarks=Coalesce(Subquery(
+        bookmarks.values('profile').annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_bookmark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='number_of_bookmarks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from recipe.models import Recipe
+from recipe.storage import media_storage
 from .managers import CustomUserManager
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -21,13 +25,50 @@ class CustomUser(AbstractUser):
 class Profile(models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    bookmarks = models.ManyToManyField(Recipe, related_name='bookmarked_by')
-    avatar = models.ImageField(upload_to='avatar', blank=True)
+    bookmarks = models.ManyToManyField(Recipe, related_name='bookmarked_by', through='Bookmark')
+    avatar = models.ImageField(upload_to='avatar', blank=True, storage=media_storage)
+    # Dimensions and resized copies of the avatar, see recipe.images
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.CharField(max_length=200, blank=True)
+    # Denormalized like Recipe.number_of_bookmarks, kept in sync by the
+    # bookmark write paths and repaired by `recount_profile_counters`.
+    # Those updates move updated_at too, so it stays a valid Last-Modified.
+    number_of_bookmarks = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.user.username
 
+
+class Bookmark(models.Model):
+    """
+    Link behind Profile.bookmarks, recording when the recipe was bookmarked
+    """
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE)
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        # The table Django created for the plain many-to-many field
+        db_table = 'users_profile_bookmarks'
+        unique_together = ('profile', 'recipe')
+        indexes = [
+            # Backs keyset pagination over a profile's (created_at, id)
+            models.Index(fields=['profile', '-created_at', '-id'],
+                         name='bookmark_profile_created_idx'),
+        ]
+
+
+def count_profile_bookmarks_subquery():
+    """
+    Subquery counting the bookmarks of the outer profile.
+    """
+    bookmarks = Bookmark.objects.filter(profile=OuterRef('pk')).order_by()
+    return Coalesce(Subquery(
+        bookmarks.values('profile').annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField()), 0)
+
+
 def get_user_id_by_email(email):
     try:
         user = CustomUser.objects.get(email=email)
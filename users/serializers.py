@@ -2,7 +2,15 @@ from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
 
-from .models import CustomUser, Profile
+from recipe.models import Recipe
+from recipe.serializers import ImageVariantsField, UploadSessionField, UploadedImageMixin
+from .models import Bookmark, CustomUser, Profile
+from .throttling import limit_password_hashing
+
+# Recipes added or removed by one bookmarks request
+BOOKMARKS_MAX_BATCH = 500
+# Most bookmark ids the profile returns as `recent_bookmarks`
+PROFILE_RECENT_BOOKMARKS_MAX = 20
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -35,7 +43,8 @@ class UserLoginSerializer(serializers.Serializer):
     password = serializers.CharField(write_only=True)
 
     def validate(self, data):
-        user = authenticate(**data)
+        with limit_password_hashing():
+            user = authenticate(**data)
         if user and user.is_active:
             return user
         raise serializers.ValidationError('Incorrect Credentials')
@@ -44,19 +53,77 @@ class UserLoginSerializer(serializers.Serializer):
 class ProfileSerializer(CustomUserSerializer):
     """
     Serializer class to serialize the user Profile model
+
+    Bookmarks are returned as a count, plus the ids of the latest ones
+    with `?recent_bookmarks=<n>` (up to PROFILE_RECENT_BOOKMARKS_MAX). The
+    full list is paginated at /api/user/profile/<user id>/bookmarks/.
+    Writing `bookmarks` replaces the whole set.
     """
+    # Declared, as fields going through a model are read-only by default
+    bookmarks = serializers.PrimaryKeyRelatedField(
+        many=True, allow_empty=False, write_only=True, queryset=Recipe.objects.all())
+    recent_bookmarks = serializers.SerializerMethodField()
+
     class Meta:
         model = Profile
-        fields = ('bookmarks', 'bio')
+        fields = ('bookmarks', 'number_of_bookmarks', 'recent_bookmarks', 'bio')
+        read_only_fields = ('number_of_bookmarks',)
+
+    def get_recent_limit(self):
+        request = self.context.get('request')
+        try:
+            limit = int(request.query_params['recent_bookmarks'])
+        except (AttributeError, KeyError, ValueError):
+            return None
+        return min(max(limit, 0), PROFILE_RECENT_BOOKMARKS_MAX)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.get_recent_limit() is None:
+            del fields['recent_bookmarks']
+        return fields
+
+    def get_recent_bookmarks(self, obj):
+        return list(Bookmark.objects.filter(profile=obj).order_by(
+            '-created_at', '-id').values_list('recipe_id', flat=True)[:self.get_recent_limit()])
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        if 'bookmarks' in validated_data:
+            # Moved by the bookmark signals with an UPDATE
+            instance.refresh_from_db(fields=['number_of_bookmarks'])
+        return instance
 
 
-class ProfileAvatarSerializer(serializers.ModelSerializer):
+class ProfileAvatarSerializer(UploadedImageMixin, serializers.ModelSerializer):
     """
     Serializer class to serialize the avatar
     """
+    avatar_variants = ImageVariantsField()
+    upload = UploadSessionField(write_only=True, required=False)
+    upload_field = 'avatar'
+
     class Meta:
         model = Profile
-        fields = ('avatar',)
+        fields = ('avatar', 'avatar_variants', 'upload')
+
+
+class BookmarkIdsSerializer(serializers.Serializer):
+    """
+    Serializer class for the recipes to bookmark or unbookmark, given as a
+    list of `ids` or a single `id`. Validates to the sorted distinct ids.
+    """
+    id = serializers.IntegerField(required=False)
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, max_length=BOOKMARKS_MAX_BATCH)
+
+    def validate(self, data):
+        ids = set(data.get('ids', ()))
+        if 'id' in data:
+            ids.add(data['id'])
+        if not ids:
+            raise serializers.ValidationError('Provide a recipe `id` or a list of `ids`.')
+        return sorted(ids)
 
 
 class PasswordChangeSerializer(serializers.Serializer):
@@ -1,4 +1,9 @@
-from django.db.models.signals import post_save
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver
 from django.core.mail import EmailMultiAlternatives
@@ -7,7 +12,12 @@ from django.urls import reverse
 
 from django_rest_passwordreset.signals import reset_password_token_created
 
-from .models import Profile
+from recipe.cache import invalidate_recipes
+from recipe.images import get_image_files
+from recipe.models import Recipe, RecipeLike
+from recipe.storage import delete_on_commit
+from .authentication import invalidate_user
+from .models import Bookmark, Profile
 
 
 User = get_user_model()
@@ -15,13 +25,123 @@ User = get_user_model()
 
 @receiver(post_save, sender=User)
 def create_profile(sender, instance, created, **kwargs):
+    # Also caches the profile on the user, so reading it costs no query
     if created:
         Profile.objects.create(user=instance)
 
 
 @receiver(post_save, sender=User)
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, created=False, **kwargs):
+    # Covers deactivation and password changes, both saved through here. A
+    # new user has nothing cached yet.
+    if created:
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(pre_save, sender=Profile)
+def remember_previous_avatar(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        previous = Profile.objects.filter(pk=instance.pk).values_list(
+            'avatar', 'avatar_variants').first()
+        instance._previous_files = get_image_files(*previous) if previous else []
+
+
+@receiver(post_save, sender=Profile)
+def release_replaced_avatar(sender, instance, raw=False, **kwargs):
+    previous_files = getattr(instance, '_previous_files', None)
+    if previous_files and not raw:
+        replaced = Counter(previous_files) - Counter(
+            get_image_files(instance.avatar.name, instance.avatar_variants))
+        delete_on_commit(replaced.elements(), Profile, 'avatar')
+
+
+@receiver(post_delete, sender=Profile)
+def release_deleted_avatar(sender, instance, **kwargs):
+    delete_on_commit(
+        get_image_files(instance.avatar.name, instance.avatar_variants), Profile, 'avatar')
+
+
+def add_to_bookmark_counters(model, counts, delta, **fields):
+    """
+    Move the number_of_bookmarks of the `counts` rows by delta times their
+    count, with one UPDATE per distinct count.
+    """
+    by_count = defaultdict(list)
+    for pk, count in counts.items():
+        by_count[count].append(pk)
+    for count, ids in by_count.items():
+        model.objects.filter(id__in=ids).update(
+            number_of_bookmarks=F('number_of_bookmarks') + delta * count, **fields)
+
+
+@receiver(m2m_changed, sender=Profile.bookmarks.through)
+def update_bookmark_counters(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep Recipe.number_of_bookmarks and Profile.number_of_bookmarks in step
+    with the bookmarks table.
+
+    Runs inside the transaction Django opens for add/remove/clear, so the
+    counters commit or roll back together with the bookmark rows.
+    """
+    if action == 'post_add':
+        # pk_set holds only the links that were inserted
+        delta = 1
+        if reverse:
+            links = [(profile_id, instance.pk) for profile_id in pk_set]
+        else:
+            links = [(instance.pk, recipe_id) for recipe_id in pk_set]
+    elif action in ('pre_remove', 'pre_clear'):
+        # pk_set holds the requested ids, count only the links that exist
+        delta = -1
+        if reverse:
+            links = sender.objects.filter(recipe=instance)
+            if pk_set is not None:
+                links = links.filter(profile__in=pk_set)
+        else:
+            links = sender.objects.filter(profile=instance)
+            if pk_set is not None:
+                links = links.filter(recipe__in=pk_set)
+        links = list(links.values_list('profile_id', 'recipe_id'))
+    else:
+        return
+
+    recipe_counts = Counter(recipe_id for _, recipe_id in links)
+    now = timezone.now()
+    add_to_bookmark_counters(Recipe, recipe_counts, delta, updated_at=now)
+    add_to_bookmark_counters(
+        Profile, Counter(profile_id for profile_id, _ in links), delta, updated_at=now)
+
+    recipe_ids = list(recipe_counts)
+    if recipe_ids:
+        transaction.on_commit(lambda: invalidate_recipes(recipe_ids))
+
+
+@receiver(pre_delete, sender=Recipe)
+def release_recipe_bookmarks(sender, instance, **kwargs):
+    # The bookmarks are deleted in cascade, without m2m_changed
+    Profile.objects.filter(bookmark__recipe=instance).update(
+        number_of_bookmarks=F('number_of_bookmarks') - 1, updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=User)
+def release_user_likes_and_bookmarks(sender, instance, **kwargs):
+    # The user's likes and bookmarks are deleted in cascade, without
+    # m2m_changed or the like manager. Each recipe holds at most one of each
+    now = timezone.now()
+    liked = list(RecipeLike.objects.filter(user=instance).values_list('recipe_id', flat=True))
+    bookmarked = list(Bookmark.objects.filter(profile__user=instance).values_list(
+        'recipe_id', flat=True))
+    Recipe.objects.filter(id__in=liked).update(
+        number_of_likes=F('number_of_likes') - 1, updated_at=now)
+    Recipe.objects.filter(id__in=bookmarked).update(
+        number_of_bookmarks=F('number_of_bookmarks') - 1, updated_at=now)
+
+    recipe_ids = list(set(liked) | set(bookmarked))
+    if recipe_ids:
+        transaction.on_commit(lambda: invalidate_recipes(recipe_ids))
 
 
 # Password reset
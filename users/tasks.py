@@ -0,0 +1,16 @@
+from celery import shared_task
+
+from recipe import images
+from users import blacklist
+from users.models import Profile
+
+
+@shared_task(bind=True)
+def process_profile_avatar(self, profile_id, name):
+    return images.process_stored_image(
+        Profile, profile_id, 'avatar', name, images.AVATAR_WIDTHS)
+
+
+@shared_task(bind=True)
+def flush_expired_tokens(self):
+    return blacklist.flush_expired_tokens()
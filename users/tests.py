@@ -1,17 +1,40 @@
 from django.urls import reverse
 from rest_framework import status
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from .models import CustomUser, Profile
+from recipe.models import Recipe
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.core.files.uploadedfile import SimpleUploadedFile
 from PIL import Image
 import tempfile
+from datetime import timedelta
+from io import BytesIO
 
+from config.celery import app as celery_app
+from config.settings.testing import FAKE_REDIS_CACHES
+from recipe.categories import categories
+from .authentication import UserRefreshToken, local_users
+from .blacklist import flush_expired_tokens, revoked
+from .provisioning import provision_users
+from .throttling import get_semaphore
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES, MEDIA_ROOT=tempfile.mkdtemp())
 class UserAPITestCase(TestCase):
     def setUp(self):
         # Initialize the API client
         self.client = APIClient()
+        cache.clear()
+        categories.clear()
+        local_users.clear()
+        revoked.clear()
+        # Run the tasks queued by the views in-process
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
 
         # Create a user for login tests
         self.user = CustomUser.objects.create_user(
@@ -64,6 +87,30 @@ class UserAPITestCase(TestCase):
         response = self.client.post('/api/user/register/', data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_user_registration_statements(self):
+        """Registering inserts the user and its profile, and saving a user leaves the profile alone"""
+        data = {'email': 'newuser@example.com', 'username': 'newuser', 'password': 'newpass123'}
+        # Two uniqueness checks, the savepoint, both INSERTs and its release
+        with self.assertNumQueries(6):
+            response = self.client.post('/api/user/register/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Profile.objects.filter(user__email='newuser@example.com').exists())
+
+        with self.assertNumQueries(1):
+            self.user.save()
+
+    def test_provision_users(self):
+        """Users and profiles are created in bulk, skipping taken emails"""
+        rows = [
+            {'email': 'bulk1@example.com', 'username': 'bulk1', 'password': 'bulkpass'},
+            {'email': 'bulk2@example.com', 'username': 'bulk2'},
+            {'email': 'testuser@example.com', 'username': 'taken'},
+        ]
+        self.assertEqual(provision_users(rows, batch_size=2), {'created': 2, 'skipped': 1})
+        self.assertEqual(Profile.objects.filter(user__username__startswith='bulk').count(), 2)
+        self.assertTrue(CustomUser.objects.get(username='bulk1').check_password('bulkpass'))
+        self.assertFalse(CustomUser.objects.get(username='bulk2').has_usable_password())
+
     def test_user_login(self):
         """Test the API can log in a user with correct credentials"""
         data = {
@@ -119,6 +166,22 @@ class UserAPITestCase(TestCase):
         response = self.client.get('/api/user/profile/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_get_user_profile_conditional(self):
+        """Test the profile answers 304 for a matching ETag"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        url = '/api/user/profile/?recent_bookmarks=5'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A bookmark moves the profile's validators
+        recipe_id = self.create_recipe_functionality(self.access_token).data['id']
+        self.client.post(f'/api/user/profile/{self.user.id}/bookmarks/', {'id': recipe_id},
+                         format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recent_bookmarks'], [recipe_id])
+
     def test_edit_user_profile_put(self):
         """Test Edit (PUT) user profile /api/user/profile/"""
         access_token = self.login_functionality()['tokens']['access']
@@ -167,6 +230,26 @@ class UserAPITestCase(TestCase):
         response = self.client.get('/api/user/profile/avatar/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_update_user_avatar_variants(self):
+        """A new avatar drops the previous variants and is processed after the commit"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            for size, widths in ((300, ['64w', '128w', '256w']), (100, ['64w'])):
+                avatar = BytesIO()
+                Image.new('RGB', (size, size)).save(avatar, format='JPEG')
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.patch('/api/user/profile/avatar/', {
+                        'avatar': SimpleUploadedFile(name='me.jpg', content=avatar.getvalue(),
+                                                     content_type='image/jpeg'),
+                    }, format='multipart')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.data['avatar_variants'], {})
+
+                variants = self.client.get('/api/user/profile/avatar/').data['avatar_variants']
+                self.assertEqual((variants['width'], variants['height']), (size, size))
+                candidates = variants['srcset']['jpeg'].split(', ')
+                self.assertEqual([candidate.split(' ')[1] for candidate in candidates], widths)
+
     def test_get_bookmarks(self):
         """Test Get user bookmarks /api/user/profile/:userid/bookmarks/"""
         data = {
@@ -214,6 +297,62 @@ class UserAPITestCase(TestCase):
         delete_bookmark_response = self.client.delete(f'/api/user/profile/{userID}/bookmarks/', recipe_data_payload, format='json')
         self.assertEqual(delete_bookmark_response.status_code, status.HTTP_200_OK)
 
+    def test_bulk_bookmarks(self):
+        """Bookmarks are added and removed in bulk, listed newest first by cursor, and only by their owner"""
+        access_token = self.login_functionality()['tokens']['access']
+        recipe_ids = [self.create_recipe_functionality(access_token).data['id'] for _ in range(3)]
+        url = f'/api/user/profile/{self.user.id}/bookmarks/'
+
+        response = self.client.post(url, {'ids': recipe_ids[:2]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url, {'id': recipe_ids[2]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url, {'ids': [recipe_ids[0], 0]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.get(id=recipe_ids[0]).number_of_bookmarks, 1)
+
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [recipe_ids[2], recipe_ids[1]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([recipe['id'] for recipe in response.data['results']], [recipe_ids[0]])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.delete(url, {'ids': recipe_ids[1:]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(self.user.profile.bookmarks.values_list('id', flat=True)),
+                         recipe_ids[:1])
+
+        other = CustomUser.objects.create_user(
+            username='other', email='other@example.com', password='otherpass')
+        response = self.client.post(f'/api/user/profile/{other.id}/bookmarks/',
+                                    {'ids': recipe_ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_profile_bookmark_count(self):
+        """The profile returns a maintained bookmark count and, on request, the latest ids"""
+        access_token = self.login_functionality()['tokens']['access']
+        recipe_ids = [self.create_recipe_functionality(access_token).data['id'] for _ in range(3)]
+        url = f'/api/user/profile/{self.user.id}/bookmarks/'
+        for recipe_id in recipe_ids:
+            self.client.post(url, {'id': recipe_id}, format='json')
+
+        response = self.client.get('/api/user/profile/')
+        self.assertEqual(response.data['number_of_bookmarks'], 3)
+        self.assertNotIn('bookmarks', response.data)
+        self.assertNotIn('recent_bookmarks', response.data)
+        response = self.client.get('/api/user/profile/', {'recent_bookmarks': 2})
+        self.assertEqual(response.data['recent_bookmarks'], recipe_ids[:0:-1])
+
+        Recipe.objects.get(id=recipe_ids[0]).delete()
+        self.client.delete(url, {'id': recipe_ids[1]}, format='json')
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.number_of_bookmarks, 1)
+
+        response = self.client.patch('/api/user/profile/', {'bookmarks': recipe_ids[1:]},
+                                     format='json')
+        self.assertEqual(response.data['number_of_bookmarks'], 2)
+
     def test_schema(self):
         """API Test schema"""
         schema_response = self.client.get('/api/schema/')
@@ -277,3 +416,99 @@ class UserAPITestCase(TestCase):
         }
         second_user_response = self.client.post('/api/user/password/reset/', user_data_not_present, format='json')
         self.assertEqual(second_user_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cached_authentication(self):
+        """Requests resolve the user from the cache, which saving the user invalidates"""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+        self.client.get('/api/user/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/user/')
+        self.assertEqual(response.data['username'], 'testuser')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get('/api/user/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post('/api/user/token/refresh/',
+                                    {'refresh': str(self.refresh_token)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(JWT_STATELESS_USER=True)
+    def test_stateless_authentication(self):
+        """Stateless mode reads the user from the token claims"""
+        access_token = str(UserRefreshToken.for_user(self.user).access_token)
+        self.client.get('/api/recipe/categories/')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recipe/categories/')
+        self.assertEqual(response.wsgi_request.user.username, 'testuser')
+
+    def test_refresh_token_blacklist(self):
+        """Rotated and logged out refresh tokens are revoked in Redis, not in the database"""
+        refresh = self.login_functionality()['tokens']['refresh']
+        response = self.client.post('/api/user/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post('/api/user/token/refresh/', {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with override_settings(JWT_BLACKLIST_BLOOM=True):
+            refresh = self.login_functionality()['tokens']['refresh']
+            self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.access_token}')
+            self.client.post('/api/user/logout/', {'refresh': refresh}, format='json')
+            revoked.clear()  # as in another process, caught up from the log
+            response = self.client.post('/api/user/token/refresh/', {'refresh': refresh},
+                                        format='json')
+            self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(BlacklistedToken.objects.exists())
+        # Only the token created by setUp through simplejwt
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+    def test_flush_expired_tokens(self):
+        """Expired outstanding tokens are deleted in batches"""
+        expired = timezone.now() - timedelta(days=1)
+        OutstandingToken.objects.bulk_create([
+            OutstandingToken(user=self.user, jti=f'expired-{index}', token='x', expires_at=expired)
+            for index in range(3)])
+        self.assertEqual(flush_expired_tokens(batch_size=2), 3)
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+    @override_settings(LOGIN_THROTTLE_RATES={'login_ip': None, 'login_email': '2/min'})
+    def test_login_throttling(self):
+        """Logins beyond the rate for an email are rejected before the password check"""
+        data = {'email': 'TestUser@example.com', 'password': 'wrong'}
+        for _ in range(2):
+            response = self.client.post('/api/user/login/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        data['email'] = 'testuser@example.com'
+        response = self.client.post('/api/user/login/', data, format='json',
+                                    HTTP_X_FORWARDED_FOR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        # The owner logging in from elsewhere is not locked out
+        data['password'] = 'testpass'
+        response = self.client.post('/api/user/login/', data, format='json',
+                                    REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(LOGIN_HASH_CONCURRENCY=1, LOGIN_HASH_QUEUE_TIMEOUT=0)
+    def test_login_hash_limiter(self):
+        """A login finding every hashing slot taken gets a 503"""
+        semaphore = get_semaphore()
+        semaphore.acquire()
+        self.addCleanup(semaphore.release)
+        data = {'email': 'testuser@example.com', 'password': 'testpass'}
+        response = self.client.post('/api/user/login/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_password_hash_upgrade(self):
+        """Logging in re-hashes the password with the configured iterations"""
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            self.user.set_password('testpass')
+            self.user.save()
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.login_functionality()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
@@ -0,0 +1,118 @@
+"""
+Login protection.
+
+A password check runs PBKDF2 on the worker, so a burst of logins would
+starve every other endpoint of CPU. Logins are therefore
+
+- throttled per IP and per email and IP with sliding windows in Redis,
+  before anything is hashed. Every attempt counts, rejected ones
+  included, so a sustained attack stays throttled. The email window is
+  keyed on the IP too, so nobody can lock a known email out from
+  elsewhere. The client IP follows REST_FRAMEWORK['NUM_PROXIES'];
+- limited to LOGIN_HASH_CONCURRENCY password checks at once per process.
+  A login that waits longer than LOGIN_HASH_QUEUE_TIMEOUT for a slot
+  gets a 503 instead of queueing behind the attack.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import SimpleRateThrottle
+
+KEY_PREFIX = 'users:throttle'
+
+
+class LoginBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again shortly.'
+    default_code = 'login_busy'
+    # Sent as Retry-After
+    wait = 1
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """
+    Counts the attempts of the last window in a Redis sorted set. Rates
+    come from LOGIN_THROTTLE_RATES, a scope without one is not throttled.
+    Lets requests through when Redis is down.
+    """
+    def get_rate(self):
+        return settings.LOGIN_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        now = time.time()
+        pipe = get_redis_connection('default').pipeline()
+        pipe.zremrangebyscore(key, '-inf', now - self.duration)
+        pipe.zadd(key, {uuid.uuid4().hex: now})
+        pipe.zcard(key)
+        pipe.zrange(key, 0, 0, withscores=True)
+        pipe.expire(key, self.duration)
+        try:
+            _, _, count, oldest, _ = pipe.execute()
+        except RedisError:
+            return True
+        if count <= self.num_requests:
+            return True
+        self.retry_after = oldest[0][1] + self.duration - now if oldest else self.duration
+        return False
+
+    def wait(self):
+        return max(self.retry_after, 0)
+
+
+class LoginIPRateThrottle(SlidingWindowRateThrottle):
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return f'{KEY_PREFIX}:{self.scope}:{self.get_ident(request)}'
+
+
+class LoginEmailRateThrottle(SlidingWindowRateThrottle):
+    scope = 'login_email'
+
+    def get_cache_key(self, request, view):
+        email = request.data.get('email')
+        if not isinstance(email, str):
+            return None
+        digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return f'{KEY_PREFIX}:{self.scope}:{digest}:{self.get_ident(request)}'
+
+
+semaphores = {}
+semaphores_lock = threading.Lock()
+
+
+def get_semaphore():
+    limit = settings.LOGIN_HASH_CONCURRENCY
+    with semaphores_lock:
+        if limit not in semaphores:
+            semaphores[limit] = threading.BoundedSemaphore(limit)
+        return semaphores[limit]
+
+
+@contextmanager
+def limit_password_hashing():
+    """
+    Hold one of this process's password hashing slots, raising LoginBusy
+    when none frees up within LOGIN_HASH_QUEUE_TIMEOUT.
+    """
+    semaphore = get_semaphore()
+    if not semaphore.acquire(timeout=settings.LOGIN_HASH_QUEUE_TIMEOUT):
+        raise LoginBusy
+    try:
+        yield
+    finally:
+        semaphore.release()
@@ -1,6 +1,4 @@
 from django.urls import path
-from rest_framework_simplejwt.views import TokenRefreshView
-
 from users import views
 
 app_name = 'users'
@@ -9,7 +7,7 @@ urlpatterns = [
     path('register/', views.UserRegisterationAPIView.as_view(),
          name="create-user"),
     path('login/', views.UserLoginAPIView.as_view(), name="login-user"),
-    path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
+    path('token/refresh/', views.UserTokenRefreshAPIView.as_view(), name='token-refresh'),
     path('logout/', views.UserLogoutAPIView.as_view(), name='logout-user'),
     path('', views.UserAPIView.as_view(), name='user-info'),
     path('profile/', views.UserProfileAPIView.as_view(),
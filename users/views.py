@@ -1,17 +1,27 @@
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.generics import GenericAPIView, ListCreateAPIView, RetrieveUpdateAPIView, UpdateAPIView
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.generics import GenericAPIView, ListAPIView, RetrieveUpdateAPIView, UpdateAPIView
+from rest_framework_simplejwt.views import TokenRefreshView
 from django.contrib.auth import get_user_model
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import F
 from django.http import HttpResponse
 from send_mail_app.tasks import send_mail_function
 
+from recipe.conditional import (
+    get_not_modified_response, make_etag, set_validators, vary_on_user)
 from recipe.models import Recipe
 from .models import Profile
-from recipe.serializers import RecipeSerializer
+from recipe.like_buffer import merge_like_counts
+from recipe.images import process_on_commit
+from recipe.pagination import BookmarkCursorPagination
+from recipe.serializers import LIST_COLUMNS, RecipeListSerializer, prune_queryset
 from . import serializers
+from .authentication import UserRefreshToken, UserTokenRefreshSerializer
+from .throttling import LoginEmailRateThrottle, LoginIPRateThrottle
+from .tasks import process_profile_avatar
 
 
 
@@ -28,8 +38,11 @@ class UserRegisterationAPIView(GenericAPIView):
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save()
-        token = RefreshToken.for_user(user)
+        # The user and the profile its post_save creates are two INSERTs;
+        # issuing the token writes nothing
+        with transaction.atomic():
+            user = serializer.save()
+            token = UserRefreshToken.for_user(user)
         data = serializer.data
         data['tokens'] = {
             'refresh': str(token),
@@ -44,13 +57,15 @@ class UserLoginAPIView(GenericAPIView):
     """
     permission_classes = (AllowAny,)
     serializer_class = serializers.UserLoginSerializer
+    # Checked before the password is hashed
+    throttle_classes = (LoginIPRateThrottle, LoginEmailRateThrottle)
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data
         serializer = serializers.CustomUserSerializer(user)
-        token = RefreshToken.for_user(user)
+        token = UserRefreshToken.for_user(user)
         data = serializer.data
         data['tokens'] = {
             'refresh': str(token),
@@ -59,6 +74,13 @@ class UserLoginAPIView(GenericAPIView):
         return Response(data, status=status.HTTP_200_OK)
 
 
+class UserTokenRefreshAPIView(TokenRefreshView):
+    """
+    An endpoint to exchange a refresh token for new tokens, for active users only.
+    """
+    serializer_class = UserTokenRefreshSerializer
+
+
 class UserLogoutAPIView(GenericAPIView):
     """
     An endpoint to logout users.
@@ -68,7 +90,7 @@ class UserLogoutAPIView(GenericAPIView):
     def post(self, request, *args, **kwargs):
         try:
             refresh_token = request.data["refresh"]
-            token = RefreshToken(refresh_token)
+            token = UserRefreshToken(refresh_token)
             token.blacklist()
             return Response(status=status.HTTP_205_RESET_CONTENT)
         except Exception as e:
@@ -97,6 +119,25 @@ class UserProfileAPIView(RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user.profile
 
+    def get_validators(self, profile):
+        """
+        Returns the (etag, last_modified) pair of the profile, from its row.
+        """
+        params = sorted(self.request.query_params.lists())
+        return (
+            make_etag('profile', profile.pk, profile.updated_at.isoformat(), params),
+            int(profile.updated_at.timestamp()),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        # Answered before serializing, which may query the bookmarks
+        profile = self.get_object()
+        validators = self.get_validators(profile)
+        response = get_not_modified_response(request, *validators)
+        if response is None:
+            response = Response(self.get_serializer(profile).data)
+        return set_validators(response, *validators)
+
 
 class UserAvatarAPIView(RetrieveUpdateAPIView):
     """
@@ -109,37 +150,73 @@ class UserAvatarAPIView(RetrieveUpdateAPIView):
     def get_object(self):
         return self.request.user.profile
 
+    def perform_update(self, serializer):
+        if 'avatar' not in serializer.validated_data:
+            serializer.save()
+            return
+        # The variants of the previous avatar no longer apply
+        profile = serializer.save(avatar_variants={})
+        if profile.avatar:
+            process_on_commit(process_profile_avatar, profile.pk, profile.avatar.name)
+
 
-class UserBookmarkAPIView(ListCreateAPIView):
+@vary_on_user
+class UserBookmarkAPIView(ListAPIView):
     """
-    Get, Create, Delete favorite recipe
+    Get a user's bookmarked recipes, most recently bookmarked first, a
+    cursor page at a time. The owner adds (POST) or removes (DELETE)
+    bookmarks by recipe `id` or a list of `ids`.
     """
-    serializer_class = RecipeSerializer
     permission_classes = (IsAuthenticated,)
-    profile = Profile.objects.all()
+    pagination_class = BookmarkCursorPagination
+
+    def get_serializer_class(self):
+        if self.request is not None and self.request.method in ('POST', 'DELETE'):
+            return serializers.BookmarkIdsSerializer
+        return RecipeListSerializer
+
+    def get_profile_id(self):
+        profile_id = Profile.objects.filter(user_id=self.kwargs['pk']).values_list(
+            'id', flat=True).first()
+        if profile_id is None:
+            raise NotFound()
+        return profile_id
+
+    def get_owner_profile(self):
+        if self.request.user.pk != self.kwargs['pk']:
+            raise PermissionDenied('You can only change your own bookmarks.')
+        return Profile(id=self.get_profile_id(), user_id=self.kwargs['pk'])
 
     def get_queryset(self):
-        user = User.objects.get(id=self.kwargs['pk'])
-        user_profile = get_object_or_404(self.profile, user=user)
-        return user_profile.bookmarks.all()
+        recipes = Recipe.objects.filter(bookmark__profile_id=self.get_profile_id()).annotate(
+            bookmarked_at=F('bookmark__created_at'), bookmark_id=F('bookmark__id'))
+        return prune_queryset(recipes, self.get_serializer(), LIST_COLUMNS)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        merge_like_counts(response.data['results'])
+        return response
+
+    def get_recipe_ids(self):
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     def post(self, request, pk):
-        user = User.objects.get(id=pk)
-        user_profile = get_object_or_404(self.profile, user=user)
-        recipe = Recipe.objects.get(id=request.data['id'])
-        if user_profile:
-            user_profile.bookmarks.add(recipe)
-            return Response(status=status.HTTP_200_OK)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        profile = self.get_owner_profile()
+        recipe_ids = self.get_recipe_ids()
+        found = set(Recipe.objects.filter(id__in=recipe_ids).values_list('id', flat=True))
+        missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in found]
+        if missing:
+            raise ValidationError({'ids': [f'No recipe with id {recipe_id}.' for recipe_id in missing]})
+        # One INSERT for the recipes not bookmarked yet
+        profile.bookmarks.add(*recipe_ids)
+        return Response(status=status.HTTP_200_OK)
 
     def delete(self, request, pk):
-        user = User.objects.get(id=pk)
-        user_profile = get_object_or_404(self.profile, user=user)
-        recipe = Recipe.objects.get(id=request.data['id'])
-        if user_profile:
-            user_profile.bookmarks.remove(recipe)
-            return Response(status=status.HTTP_200_OK)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        profile = self.get_owner_profile()
+        profile.bookmarks.remove(*self.get_recipe_ids())
+        return Response(status=status.HTTP_200_OK)
 
 
 class PasswordChangeAPIView(UpdateAPIView):